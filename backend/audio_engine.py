@@ -0,0 +1,191 @@
+"""
+Audio stimulus engine.
+
+Waveforms (tones, white noise, click trains) are synthesized once into int16
+NumPy buffers and cached by (kind, frequency, duration, amplitude). Playback
+requests are queued to a dedicated output thread that writes the cached
+buffer to a sink, so callers never block and the onset is not delayed by
+synthesis.
+
+Sinks:
+    alsa  - ALSA PCM playback through pyalsaaudio (the Pi)
+    null  - discards the samples but keeps real-time pacing (development)
+    file  - appends every played buffer to a WAV file (checking stimuli offline)
+"""
+import os
+import queue
+import threading
+import time
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = int(os.getenv("AUDIO_RATE", 44100))
+RAMP_S = 0.005  # Fade in/out so tone edges don't click
+
+
+def _ramp(samples, rate):
+    n = min(int(RAMP_S * rate), len(samples) // 2)
+    if n > 0:
+        envelope = np.linspace(0.0, 1.0, n, dtype=np.float32)
+        samples[:n] *= envelope
+        samples[-n:] *= envelope[::-1]
+    return samples
+
+
+def synthesize(kind, frequency, duration, amplitude, rate=SAMPLE_RATE):
+    """Returns the waveform as a read-only int16 array."""
+    n = max(1, int(round(duration * rate)))
+    if kind == "tone":
+        t = np.arange(n, dtype=np.float32) / rate
+        samples = _ramp(np.sin(2 * np.pi * frequency * t).astype(np.float32), rate)
+    elif kind == "noise":
+        # Fixed seed: the same key always gives the same noise
+        samples = _ramp(np.random.default_rng(0).uniform(-1.0, 1.0, n).astype(np.float32), rate)
+    elif kind == "click":
+        # 1ms rectangular clicks repeated `frequency` times per second
+        samples = np.zeros(n, dtype=np.float32)
+        period = max(1, int(rate / frequency)) if frequency > 0 else n
+        width = max(1, int(0.001 * rate))
+        for start in range(0, n, period):
+            samples[start:start + width] = 1.0
+    else:
+        raise ValueError(f"Unknown sound type: {kind}")
+    buffer = (samples * (max(0.0, min(1.0, amplitude)) * 32767)).astype(np.int16)
+    buffer.flags.writeable = False
+    return buffer
+
+
+class NullSink:
+    """Discards audio but sleeps for its duration, like a real device would block."""
+    def __init__(self, rate=SAMPLE_RATE):
+        self.rate = rate
+
+    def write(self, samples):
+        time.sleep(len(samples) / self.rate)
+
+    def close(self):
+        pass
+
+
+class WavFileSink:
+    """Appends everything played to a mono 16-bit WAV file."""
+    def __init__(self, path, rate=SAMPLE_RATE):
+        self.rate = rate
+        self._wav = wave.open(path, "wb")
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(rate)
+
+    def write(self, samples):
+        self._wav.writeframes(samples.tobytes())
+
+    def close(self):
+        self._wav.close()
+
+
+class AlsaSink:
+    """ALSA playback. The PCM is opened once and kept open to avoid setup time on each stimulus."""
+    def __init__(self, device="default", rate=SAMPLE_RATE, period_size=256):
+        import alsaaudio # Only needed on the Pi
+        self.rate = rate
+        self.period_size = period_size
+        self._pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_PLAYBACK,
+            device=device,
+            channels=1,
+            rate=rate,
+            format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=period_size,
+        )
+
+    def write(self, samples):
+        data = samples.tobytes()
+        step = self.period_size * 2
+        for i in range(0, len(data), step):
+            self._pcm.write(data[i:i + step])
+
+    def close(self):
+        self._pcm.close()
+
+
+def open_sink(name=None):
+    """Creates the sink named by AUDIO_SINK (alsa | null | file:<path>), defaulting to null."""
+    name = name or os.getenv("AUDIO_SINK", "null")
+    if name == "alsa":
+        return AlsaSink(device=os.getenv("AUDIO_DEVICE", "default"))
+    if name.startswith("file:"):
+        return WavFileSink(name[len("file:"):])
+    return NullSink()
+
+
+class AudioEngine:
+    """
+    Plays cached waveforms from a dedicated output thread.
+
+    play() returns immediately. `on_onset` (if given) is called from the
+    output thread right before the first sample is written, and the delay
+    between the request and that moment is recorded as the onset latency.
+    """
+    def __init__(self, sink=None, rate=SAMPLE_RATE):
+        self.sink = sink if sink is not None else open_sink()
+        self.rate = rate
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.onset_latencies = []  # Seconds, most recent last (capped)
+        self.played = 0
+        self._thread = threading.Thread(target=self._run, name="audio-output", daemon=True)
+        self._thread.start()
+
+    def prepare(self, kind, frequency, duration, amplitude):
+        """Synthesizes (or fetches) a buffer ahead of time so the first play has no synthesis cost."""
+        key = (kind, float(frequency), float(duration), float(amplitude))
+        buffer = self._cache.get(key)
+        if buffer is None:
+            with self._cache_lock:
+                buffer = self._cache.get(key)
+                if buffer is None:
+                    buffer = synthesize(kind, frequency, duration, amplitude, self.rate)
+                    self._cache[key] = buffer
+        return buffer
+
+    def play(self, kind="tone", frequency=2000.0, duration=1.0, amplitude=0.5, on_onset=None):
+        buffer = self.prepare(kind, frequency, duration, amplitude)
+        self._queue.put((time.perf_counter(), buffer, on_onset))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            requested, buffer, on_onset = item
+            onset = time.perf_counter()
+            if on_onset is not None:
+                try:
+                    on_onset()
+                except Exception as e:
+                    print(f"Error in audio onset callback: {e}")
+            try:
+                self.sink.write(buffer)
+            except Exception as e:
+                print(f"Error playing sound: {e}")
+                continue
+            self.played += 1
+            self.onset_latencies.append(onset - requested)
+            if len(self.onset_latencies) > 1000:
+                del self.onset_latencies[:500]
+
+    def stats(self):
+        latencies = sorted(self.onset_latencies)
+        return {
+            "played": self.played,
+            "cached_buffers": len(self._cache),
+            "last_onset_latency_ms": round(self.onset_latencies[-1] * 1000, 3) if latencies else None,
+            "max_onset_latency_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+        }
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self.sink.close()
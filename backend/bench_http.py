@@ -0,0 +1,149 @@
+"""
+HTTP load test for the backend.
+
+Starts the backend under each server (Flask dev server and waitress, via
+serve.py), hammers a set of endpoints from concurrent client threads for a
+fixed time, and prints requests/sec and latency percentiles side by side.
+
+    python bench_http.py
+    python bench_http.py --clients 32 --duration 20 --path /counts --path /
+    python bench_http.py --url http://raspberrypi:5001   # test a running server only
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from latency_stats import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(host, port, timeout=30.0):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"server on port {port} did not start")
+
+
+def client(host, port, paths, deadline, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+            latencies.append(time.perf_counter() - start)
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=10)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.close()
+
+
+def run_load(host, port, paths, clients, duration):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client, args=(host, port, paths, deadline, latencies, errors))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": (percentile(latencies, 50) or 0.0) * 1000,
+        "p95_ms": (percentile(latencies, 95) or 0.0) * 1000,
+        "p99_ms": (percentile(latencies, 99) or 0.0) * 1000,
+        "max_ms": (latencies[-1] * 1000) if latencies else 0.0,
+        "mean_ms": (statistics.fmean(latencies) * 1000) if latencies else 0.0,
+    }
+
+
+def bench_server(server, args):
+    port = free_port()
+    env = dict(os.environ, GPIO_MODE=os.getenv("GPIO_MODE", "mock"))
+    cmd = [sys.executable, os.path.join(HERE, "serve.py"), "--server", server,
+           "--host", "127.0.0.1", "--port", str(port), "--threads", str(args.threads)]
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up("127.0.0.1", port)
+        return run_load("127.0.0.1", port, args.path, args.clients, args.duration)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_table(results):
+    print(f"{'server':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['rps']:>10.1f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}{r['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--threads", type=int, default=8, help="waitress worker threads")
+    parser.add_argument("--path", action="append", help="Endpoint(s) to request (default: /counts)")
+    parser.add_argument("--server", action="append", choices=["dev", "waitress"], help="Servers to compare (default: both)")
+    parser.add_argument("--url", help="Load-test an already running server instead of starting one")
+    args = parser.parse_args()
+    args.path = args.path or ["/counts"]
+
+    results = {}
+    if args.url:
+        url = urllib.parse.urlparse(args.url)
+        results[url.netloc] = run_load(url.hostname, url.port or 80, args.path, args.clients, args.duration)
+    else:
+        for server in args.server or ["dev", "waitress"]:
+            print(f"Benchmarking {server} ({args.clients} clients, {args.duration:.0f}s)...")
+            results[server] = bench_server(server, args)
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
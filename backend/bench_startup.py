@@ -0,0 +1,85 @@
+"""
+Startup-time benchmark for the backend.
+
+Starts the backend in a fresh process (mock GPIO by default) and measures how
+long it takes until `/` answers. Exits non-zero if the median over the runs is
+above the budget, so it can guard against slow imports creeping back in.
+
+    python bench_startup.py                 # sbBackend.py, 5 runs, 2.0s budget
+    python bench_startup.py --runs 3 --budget 4
+
+--script must serve on $PORT. skinnerBox.py's __main__ does not (it always
+binds port 5000 and wires up buttons that are commented out), so it can't be
+measured this way.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_response(script, timeout):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    env.setdefault("GPIO_MODE", "mock")
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, script],
+        cwd=os.path.dirname(os.path.abspath(script)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{script} exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=0.5) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"{script} did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sbBackend.py"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=2.0, help="Allowed median seconds until / answers")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    results = []
+    for i in range(args.runs):
+        elapsed = time_to_first_response(args.script, args.timeout)
+        results.append(elapsed)
+        print(f"run {i + 1}: {elapsed * 1000:.0f} ms")
+
+    median = statistics.median(results)
+    print(f"median {median * 1000:.0f} ms, min {min(results) * 1000:.0f} ms, max {max(results) * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms)")
+    if median > args.budget:
+        print("FAIL: startup is over budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
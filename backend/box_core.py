@@ -0,0 +1,239 @@
+import json
+import os
+import sqlite3
+import threading
+
+from gpio_adapter import ConditionedButton, InputPolicy, LED, RGBLED
+from event_ring import EventRing, EventConsumer, INJECTED, LEVER_PRESS, NOSE_POKE
+from lazy_init import LazyResource
+from fleet_client import FleetClient
+from output_timeline import TimelinePlayer
+from input_injector import Injector
+from rate_series import RateBins
+from profiling import thread_cpu_snapshot
+
+DB_FILE = "testdatabase.db"
+input_policy_path = os.path.join(os.path.dirname(__file__), 'input_policy.json')
+
+
+def default_input_policies():
+    # Software input conditioning per input (see InputPolicy). Defaults can be
+    # overridden per input in input_policy.json, e.g.
+    #   {"lever": {"debounce_s": 0.05, "refractory_s": 0.2}}
+    policies = {
+        "lever": InputPolicy(debounce_s=0.05, min_hold_s=0.0, refractory_s=0.0),
+        "nose_poke": InputPolicy(debounce_s=0.02, min_hold_s=0.0, refractory_s=0.0),
+    }
+    try:
+        with open(input_policy_path, 'r') as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        return policies
+    except ValueError as e:
+        print(f"Ignoring invalid {input_policy_path}: {e}")
+        return policies
+    for name, data in overrides.items():
+        if name in policies:
+            policies[name] = InputPolicy.from_dict(data)
+    return policies
+
+
+class BoxCore:
+    """
+    The hardware side of the backend: input buttons, LEDs and the
+    interaction counters.
+
+    sbBackend uses one BoxCore directly, or (with SB_IO_PROCESS=1) runs it in
+    a separate process behind io_process.IOProcessClient, which has the same
+    methods. `on_counts(generation, lever, poke)` is called after every count
+    change, on the consumer thread.
+
+    If FLEET_URL is set, every input event is also streamed to that
+    collector (see collector.py).
+    """
+    def __init__(self, startup=None, on_counts=None):
+        self.startup = startup
+        self.on_counts = on_counts
+        self.input_policies = default_input_policies()
+
+        # Devices are created on first use so the HTTP server can start answering
+        # before the pin factory is set up. Inputs are initialized right after
+        # startup on a background thread (see start).
+        # Buttons (with pull-down resistors)
+        self.lever_press_button = LazyResource("lever button", lambda: ConditionedButton(4, self.input_policies["lever"], pull_up=False), startup)
+        self.nose_poke_button = LazyResource("nose poke button", lambda: ConditionedButton(18, self.input_policies["nose_poke"], pull_up=False), startup)
+        # LEDs
+        self.leds = {
+            "blue": LazyResource("blue led", lambda: LED(5), startup),
+            "orange": LazyResource("orange led", lambda: LED(24), startup),
+        }
+        self.rgb_led = LazyResource("rgb led", lambda: RGBLED(red=12, green=16, blue=20), startup)
+        self.timeline = TimelinePlayer(self.apply_output)
+
+        # Counters for interactions
+        self.lever_press_count = 0
+        self.nose_poke_count = 0
+        self.counts_generation = 0  # Bumped on every count change, used as the /counts ETag
+        self.counter_lock = threading.Lock()
+        self.test_active = False
+        self.rates = RateBins(("lever", "nose_poke"))  # Per-second counts for the live charts
+
+        fleet_url = os.getenv("FLEET_URL")
+        self.fleet = FleetClient(fleet_url) if fleet_url else None
+
+        # Input events are stamped by the GPIO callbacks and applied by a single consumer
+        # thread, so the callbacks never wait on the counter lock or the database.
+        self.event_wakeup = threading.Event()
+        self.gpio_events = EventRing(1024, wakeup=self.event_wakeup)  # Producer: GPIO callback thread
+        self.sim_events = EventRing(256, wakeup=self.event_wakeup)  # Producer: simulation requests, serialized by sim_lock
+        self.sim_lock = threading.Lock()
+        self.inject_events = EventRing(4096, wakeup=self.event_wakeup)  # Producer: the injector thread (one run at a time)
+        self.injector = Injector(self.inject_events.push)
+        self.event_consumer = EventConsumer(
+            [self.gpio_events, self.sim_events, self.inject_events],
+            {
+                LEVER_PRESS: self.apply_lever_press,
+                NOSE_POKE: self.apply_nose_poke,
+                LEVER_PRESS | INJECTED: lambda stamp: self.apply_lever_press(stamp, injected=True),
+                NOSE_POKE | INJECTED: lambda stamp: self.apply_nose_poke(stamp, injected=True),
+            },
+        )
+
+    def start(self):
+        if self.fleet is not None:
+            self.fleet.start()
+        self.event_consumer.start()
+        threading.Thread(target=self.init_inputs, name="init-inputs", daemon=True).start()
+
+    def init_inputs(self):
+        # Re-register callbacks to ensure they remain active
+        self.lever_press_button.get().when_pressed = self.on_lever_press
+        self.nose_poke_button.get().when_pressed = self.on_nose_poke
+
+    ## Inputs ##
+    # Callback functions to count button presses, called with the accepted press time
+    def on_lever_press(self, pressed_at):
+        self.gpio_events.push_at(LEVER_PRESS, pressed_at)
+
+    def on_nose_poke(self, pressed_at):
+        self.gpio_events.push_at(NOSE_POKE, pressed_at)
+
+    def simulate(self, code):
+        with self.sim_lock:
+            return self.sim_events.push(code)
+
+    # Event handlers, only ever run on the consumer thread
+    def apply_lever_press(self, stamp, injected=False):
+        with self.counter_lock:
+            self.lever_press_count += 1
+            self.counts_generation += 1
+            print("Lever pressed. Count:", self.lever_press_count)
+        if injected:
+            self.injector.observe(stamp)
+        self.rates.record("lever", stamp)
+        self._counts_changed()
+        self._record_fleet("lever", stamp)
+        self._db_increment("Lever Presses Actual", "Lever Press")
+
+    def apply_nose_poke(self, stamp, injected=False):
+        with self.counter_lock:
+            self.nose_poke_count += 1
+            self.counts_generation += 1
+            print("Nose poke. Count:", self.nose_poke_count)
+        if injected:
+            self.injector.observe(stamp)
+        self.rates.record("nose_poke", stamp)
+        self._counts_changed()
+        self._record_fleet("nose_poke", stamp)
+        self._db_increment("Nose Poke Actual", "Nose Poke")
+
+    def _counts_changed(self):
+        if self.on_counts is not None:
+            generation, counts = self.counts()
+            self.on_counts(generation, counts["lever_press_count"], counts["nose_poke_count"])
+
+    def _record_fleet(self, event_type, stamp):
+        if self.fleet is not None:
+            self.fleet.record(event_type, stamp)
+
+    def _db_increment(self, column, label):
+        # Use a new connection for each update
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            cursor = conn.cursor()
+            cursor.execute(f'UPDATE TestDB SET "{column}" = "{column}" + 1')
+            conn.commit()
+            print(f"Data updated - {label}")
+        except Exception as e:
+            print(f"Database error on {label.lower()}: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def counts(self):
+        """Returns (generation, counts dict)."""
+        with self.counter_lock:
+            return self.counts_generation, {
+                "lever_press_count": self.lever_press_count,
+                "nose_poke_count": self.nose_poke_count,
+            }
+
+    def rate_series(self, window_s, points, method, kind):
+        return self.rates.series(window_s, points, method, kind)
+
+    def thread_cpu_snapshot(self):
+        return thread_cpu_snapshot()
+
+    def input_stats(self):
+        stats = {}
+        for name, button in (("lever", self.lever_press_button), ("nose_poke", self.nose_poke_button)):
+            stats[name] = button.get().stats() if button.ready else None
+        return stats
+
+    def start_injection(self, schedule):
+        return self.injector.start(schedule)
+
+    def cancel_injection(self):
+        return self.injector.cancel()
+
+    def injection_stats(self):
+        stats = self.injector.stats()
+        stats["ring_dropped"] = self.inject_events.dropped
+        return stats
+
+    def fleet_stats(self):
+        return self.fleet.stats() if self.fleet is not None else None
+
+    def status_dict(self):
+        return {"mode": "in-process", "test_active": self.test_active}
+
+    def set_test_active(self, active):
+        self.test_active = bool(active)
+
+    ## Outputs ##
+    def set_led(self, name, on):
+        led = self.leds[name].get()
+        if on:
+            led.on()
+        else:
+            led.off()
+
+    def set_rgb(self, red, green, blue):
+        self.rgb_led.get().color = (red, green, blue)
+
+    def apply_output(self, device, value):
+        # One step of an output timeline, already validated by output_timeline.parse_timeline
+        if device == "rgb":
+            self.set_rgb(*value)
+        else:
+            self.set_led(device, value)
+
+    def run_timeline(self, steps, replace=False):
+        return self.timeline.play(steps, replace)
+
+    def cancel_timeline(self):
+        return self.timeline.cancel()
+
+    def timeline_status(self):
+        return self.timeline.status()
@@ -0,0 +1,228 @@
+"""
+Central collector for the fleet: every box's FleetClient posts its events here.
+
+    python collector.py --db fleet.db --port 6000
+
+Each box sets FLEET_URL=http://<collector>:6000 (and optionally BOX_ID).
+
+Events are stored once per (box, stream, seq), so a batch that is resent
+after a lost acknowledgement is ignored rather than duplicated. A stream is
+one run of a box's backend; its sequence numbers start again at 1 after a
+restart. The reply acknowledges the highest sequence number stored for the
+stream. Batches are written by a single
+writer thread from a bounded queue; when the queue is full the collector
+answers 503 with Retry-After and the boxes back off.
+
+A batch is never answered 200 unless it was stored. Malformed events are
+refused with 400 (the box drops the batch, as resending can't help), and a
+failed write answers 500 so the box retries it later.
+
+LocalCollector runs the same app on a background thread for testing:
+
+    with LocalCollector("test.db") as collector:
+        client = FleetClient(collector.url).start()
+"""
+import argparse
+import json
+import queue
+import sqlite3
+import threading
+import zlib
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class EventStore:
+    def __init__(self, path, max_queued_batches=64):
+        self.path = path
+        self._queue = queue.Queue(maxsize=max_queued_batches)
+        self._acks = {}
+        self._acks_lock = threading.Lock()
+        self.stored = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.write_errors = 0
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "box_id TEXT NOT NULL, stream TEXT NOT NULL, seq INTEGER NOT NULL, ts REAL, type TEXT, data TEXT, "
+            "PRIMARY KEY (box_id, stream, seq))"
+        )
+        conn.commit()
+        for box_id, stream, seq in conn.execute("SELECT box_id, stream, MAX(seq) FROM events GROUP BY box_id, stream"):
+            self._acks[(box_id, stream)] = seq
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name="collector-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def last_ack(self, box_id, stream):
+        with self._acks_lock:
+            return self._acks.get((box_id, stream), 0)
+
+    def submit(self, box_id, stream, events, timeout=2.0):
+        """
+        Queues a batch for the writer and waits until it is stored.
+        Returns the new ack for the stream, or None if the writer is backed up.
+        Raises ValueError for malformed events and sqlite3.Error if the write failed.
+        """
+        try:
+            rows = [(box_id, stream, int(seq), None if ts is None else float(ts), None if kind is None else str(kind),
+                     json.dumps(data) if data is not None else None)
+                    for seq, ts, kind, data in events]
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Malformed events: {e}") from None
+        done = threading.Event()
+        result = {}
+        try:
+            self._queue.put_nowait((box_id, stream, rows, done, result))
+        except queue.Full:
+            return None
+        if not done.wait(timeout):
+            return None
+        if "error" in result:
+            raise result["error"]
+        return self.last_ack(box_id, stream)
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            box_id, stream, rows, done, result = self._queue.get()
+            try:
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.commit()
+                inserted = conn.total_changes - before
+                self.stored += inserted
+                self.duplicates += len(rows) - inserted
+                self.batches += 1
+                if rows:
+                    key = (box_id, stream)
+                    highest = max(row[2] for row in rows)
+                    with self._acks_lock:
+                        self._acks[key] = max(self._acks.get(key, 0), highest)
+            except sqlite3.Error as e:
+                print(f"Collector write error for {box_id}: {e}")
+                conn.rollback()
+                self.write_errors += 1
+                result["error"] = e
+            finally:
+                done.set()
+
+    def stats(self):
+        with self._acks_lock:
+            acks = {f"{box_id}/{stream}": seq for (box_id, stream), seq in self._acks.items()}
+        return {
+            "stored": self.stored,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "write_errors": self.write_errors,
+            "queued_batches": self._queue.qsize(),
+            "streams": acks,
+        }
+
+
+def create_app(store, retry_after=1):
+    app = Flask(__name__)
+
+    @app.route('/ingest', methods=['POST'])
+    def ingest():
+        body = request.get_data()
+        if request.headers.get('Content-Encoding') == 'deflate':
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                return jsonify({'error': 'Bad deflate body'}), 400
+        try:
+            payload = json.loads(body)
+            box_id = str(payload['box'])
+            stream = str(payload['stream'])
+            events = payload['events']
+        except (ValueError, KeyError, TypeError):
+            return jsonify({'error': 'Expected {"box": ..., "stream": ..., "events": [...]}'}), 400
+
+        try:
+            ack = store.submit(box_id, stream, events)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400 # Would be refused again however often it is resent
+        except sqlite3.Error as e:
+            return jsonify({'error': f'Could not store events: {e}'}), 500
+        if ack is None:
+            response = jsonify({'error': 'Collector busy', 'ack': store.last_ack(box_id, stream)})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        return jsonify({'ack': ack})
+
+    @app.route('/ack/<box_id>/<stream>')
+    def ack(box_id, stream):
+        return jsonify({'ack': store.last_ack(box_id, stream)})
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(store.stats())
+
+    return app
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class LocalCollector:
+    """Runs a collector on a background thread, e.g. for tests and benchmarks."""
+    def __init__(self, db_path, host="127.0.0.1", port=0, max_queued_batches=64):
+        self.store = EventStore(db_path, max_queued_batches)
+        self.app = create_app(self.store)
+        self.server = make_server(host, port, self.app, threaded=True, request_handler=_QuietHandler)
+        self.url = f"http://{host}:{self.server.server_port}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="local-collector", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collects events from a fleet of boxes")
+    parser.add_argument("--db", default="fleet.db", help="SQLite file to store events in")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--queue", type=int, default=64, help="Batches to queue before answering 503")
+    args = parser.parse_args()
+
+    store = EventStore(args.db, args.queue)
+    app = create_app(store)
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress not installed, using the Flask development server")
+        app.run(host=args.host, port=args.port, threaded=True)
+    else:
+        print(f"Collector listening on {args.host}:{args.port}, storing to {args.db}")
+        serve(app, host=args.host, port=args.port, threads=8)
+
+
+if __name__ == "__main__":
+    main()
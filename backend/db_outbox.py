@@ -0,0 +1,216 @@
+"""
+Local store-and-forward outbox for writes to the remote database.
+
+Rows are first committed to a small SQLite file (WAL mode) on the box, then a
+background thread delivers them to the remote database in batches. If the
+remote database is down or slow, rows wait on disk and delivery is retried
+with exponential backoff, so a request that writes data never depends on the
+remote database being reachable.
+
+Delivery is at-least-once: if the box loses power after the remote commit but
+before the delivered rows are removed locally, that batch is sent again.
+
+The outbox is bounded (`max_rows` and `max_bytes` of payload); when it is
+full, put() refuses new rows instead of filling the SD card.
+
+A row the database will never accept must not hold up the rows behind it.
+`classify(exception)` says whether a failure is "transient" (retried for as
+long as it takes, e.g. the database is down), "permanent" (e.g. a constraint
+violation) or unknown (None, retried up to `max_attempts` times). When a
+batch fails for a permanent or repeated reason, its rows are retried one at
+a time, and a single row failing that way is moved to the `failed` table.
+
+Rows in `failed` are kept until an operator acts on them: requeue_failed()
+puts them back in the outbox (e.g. after a missing grant or column was
+fixed), purge_failed() deletes them.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class Outbox:
+    def __init__(self, path, deliver, batch_size=500, max_rows=100000, max_bytes=64 * 1024 * 1024,
+                 idle_interval=1.0, max_backoff=60.0, classify=None, max_attempts=5):
+        """
+        deliver(kind, payloads) writes a list of payload dicts of one kind to the
+        remote database in a single transaction, and raises if that fails.
+        classify(exception) -> "transient" | "permanent" | None, see above.
+        """
+        self.path = path
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.idle_interval = idle_interval
+        self.max_backoff = max_backoff
+        self.classify = classify or (lambda e: None)
+        self.max_attempts = max_attempts
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")  # A committed put() survives power loss
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS failed ("
+            "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL, "
+            "failed_at REAL NOT NULL, error TEXT)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()  # Interrupts the retry backoff on stop()
+        self._running = False
+        self._thread = None
+
+        self._rows, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM outbox"
+        ).fetchone()
+        self.delivered = 0
+        self.rejected = 0
+        self.failures = 0
+        self.failed = self._conn.execute("SELECT COUNT(*) FROM failed").fetchone()[0]
+        self._attempts = 0  # Failed deliveries of the current head batch
+        self._isolate_until = 0  # Rows up to this id are sent one at a time
+        self.last_error = None
+        self.last_delivery = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="db-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def put(self, kind, payload):
+        """Stores one row for delivery. Returns False if the outbox is full."""
+        text = json.dumps(payload, separators=(",", ":"))
+        with self._lock:
+            if self._rows >= self.max_rows or self._bytes + len(text) > self.max_bytes:
+                self.rejected += 1
+                return False
+            self._conn.execute("INSERT INTO outbox (kind, payload, created) VALUES (?, ?, ?)", (kind, text, time.time()))
+            self._conn.commit()
+            self._rows += 1
+            self._bytes += len(text)
+        if self._rows >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _next_batch(self):
+        # Oldest rows of the oldest kind, so each batch is one bulk insert
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, payload FROM outbox WHERE kind = (SELECT kind FROM outbox ORDER BY id LIMIT 1) "
+                "ORDER BY id LIMIT ?", (self.batch_size,)
+            ).fetchall()
+        if rows and rows[0][0] <= self._isolate_until:
+            return rows[:1]  # Looking for the row that made the batch fail
+        return rows
+
+    def _remove(self, rows):
+        ids = [(row[0],) for row in rows]
+        size = sum(len(row[2]) for row in rows)
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", ids)
+            self._conn.commit()
+            self._rows -= len(ids)
+            self._bytes -= size
+
+    def _set_aside(self, row, error):
+        # Moves a row the database won't take to the failed table, in one transaction
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO failed (id, kind, payload, created, failed_at, error) "
+                "SELECT id, kind, payload, created, ?, ? FROM outbox WHERE id = ?", (time.time(), error, row[0])
+            )
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (row[0],))
+            self._conn.commit()
+            self._rows -= 1
+            self._bytes -= len(row[2])
+            self.failed += 1
+        print(f"Outbox row {row[0]} ({row[1]}) moved to the failed table: {error}")
+
+    def requeue_failed(self):
+        """Moves every set-aside row back into the outbox, in its old place. Returns the number moved."""
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM failed").fetchone()
+            self._conn.execute("INSERT INTO outbox (id, kind, payload, created) SELECT id, kind, payload, created FROM failed")
+            self._conn.execute("DELETE FROM failed")
+            self._conn.commit()
+            self._rows += count
+            self._bytes += size
+            self.failed = 0
+            self._isolate_until = 0
+        self._wakeup.set()
+        return count
+
+    def purge_failed(self):
+        """Deletes every set-aside row. Returns the number deleted."""
+        with self._lock:
+            count = self._conn.execute("DELETE FROM failed").rowcount
+            self._conn.commit()
+            self.failed = 0
+        return count
+
+    def _run(self):
+        backoff = 1.0
+        while self._running:
+            rows = self._next_batch()
+            if not rows:
+                self._wakeup.wait(self.idle_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self.deliver(rows[0][1], [json.loads(row[2]) for row in rows])
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                kind = self.classify(e)
+                if kind != "transient":
+                    self._attempts += 1
+                if kind == "permanent" or self._attempts >= self.max_attempts:
+                    self._attempts = 0
+                    if len(rows) > 1:
+                        self._isolate_until = rows[-1][0]  # Retry these one by one to find the bad row
+                    else:
+                        self._set_aside(rows[0], self.last_error)
+                    continue
+                print(f"Outbox delivery failed ({len(rows)} rows kept, retrying in {backoff:.0f}s): {e}")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            self._attempts = 0
+            self._remove(rows)
+            self.delivered += len(rows)
+            self.last_error = None
+            self.last_delivery = time.time()
+            backoff = 1.0
+
+    def stats(self):
+        with self._lock:
+            pending, size = self._rows, self._bytes
+        return {
+            "pending": pending,
+            "pending_bytes": size,
+            "delivered": self.delivered,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "failed": self.failed,
+            "last_error": self.last_error,
+            "last_delivery": self.last_delivery,
+        }
@@ -0,0 +1,121 @@
+import threading
+import time
+
+# Event codes written into the ring by input (and stimulus) callbacks
+LEVER_PRESS = 1
+NOSE_POKE = 2
+STIMULUS_ONSET = 3  # The stimulus was presented; the box becomes interactable
+INJECTED = 0x100  # Or'ed into the code of events pushed by the load-test injector
+
+
+class EventRing:
+    """
+    Preallocated single-producer / single-consumer ring buffer for input events.
+
+    The producer (normally a GPIO callback) only stamps the event and writes it
+    into the next free slot. The consumer thread drains the slots in order and
+    applies the state changes. `_head` is only written by the producer and
+    `_tail` only by the consumer, so neither side needs a lock.
+
+    Each ring must have exactly one producer thread. Sources that can be called
+    from several threads (e.g. Flask request handlers) get their own ring and
+    serialize their pushes with a lock of their own.
+    """
+    def __init__(self, capacity=1024, wakeup=None, clock=time.time):
+        # Round up to a power of two so wrap-around is a mask instead of a modulo
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self._mask = size - 1
+        self._codes = [0] * size
+        self._stamps = [0.0] * size
+        self._head = 0  # Next slot to write (producer only)
+        self._tail = 0  # Next slot to read (consumer only)
+        self.dropped = 0  # Events lost because the consumer fell a full ring behind
+        self.wakeup = wakeup if wakeup is not None else threading.Event()
+        self.clock = clock
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def push(self, code, stamp=None):
+        """Stamps and publishes one event. Never blocks; returns False if the ring is full."""
+        head = self._head
+        if head - self._tail >= self.capacity:
+            self.dropped += 1
+            return False
+        i = head & self._mask
+        self._stamps[i] = self.clock() if stamp is None else stamp
+        self._codes[i] = code
+        self._head = head + 1  # Publish only after the slot is fully written
+        self.wakeup.set()
+        return True
+
+    def push_at(self, code, t=None, source_clock=time.monotonic):
+        """
+        Publishes an event that happened at `t` on `source_clock`, e.g. the
+        press time a ConditionedButton accepted, stamped in this ring's clock.
+        With t=None the event is stamped now.
+        """
+        if t is None:
+            return self.push(code)
+        return self.push(code, self.clock() - (source_clock() - t))
+
+    def drain(self, out):
+        """Appends every published (stamp, code) pair to `out` and frees the slots."""
+        tail = self._tail
+        head = self._head
+        while tail != head:
+            i = tail & self._mask
+            out.append((self._stamps[i], self._codes[i]))
+            tail += 1
+        self._tail = tail
+        return out
+
+
+def drain_rings(rings, out=None):
+    """Drains several rings into one list ordered by the time each event was stamped."""
+    if out is None:
+        out = []
+    for ring in rings:
+        ring.drain(out)
+    if len(out) > 1:
+        out.sort(key=lambda event: event[0])
+    return out
+
+
+class EventConsumer(threading.Thread):
+    """
+    The single thread that applies events from one or more rings.
+
+    `handlers` maps an event code to a function taking the event timestamp.
+    All rings passed in should share the same wakeup event.
+    """
+    def __init__(self, rings, handlers, idle_timeout=0.5):
+        super().__init__(name="event-consumer", daemon=True)
+        self.rings = rings
+        self.handlers = handlers
+        self.idle_timeout = idle_timeout
+        self.wakeup = rings[0].wakeup
+        self._running = True
+
+    def stop(self):
+        self._running = False
+        self.wakeup.set()
+
+    def run(self):
+        batch = []
+        while self._running:
+            self.wakeup.wait(self.idle_timeout)
+            # Clear before draining so a push racing with the drain re-arms the wakeup
+            self.wakeup.clear()
+            batch.clear()
+            for stamp, code in drain_rings(self.rings, batch):
+                handler = self.handlers.get(code)
+                if handler is None:
+                    continue
+                try:
+                    handler(stamp)
+                except Exception as e:
+                    print(f"Error handling event {code}: {e}")
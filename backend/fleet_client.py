@@ -0,0 +1,208 @@
+"""
+Streams this box's input events to a central collector (see collector.py).
+
+Events get a per-box sequence number when they are recorded, are sent in
+compressed batches, and are only dropped from the local queue once the
+collector acknowledges them. A failed or unacknowledged batch is resent with
+the same sequence numbers, and the collector ignores numbers it already has,
+so reconnects never create duplicates. Sequence numbers belong to a `stream`
+(a random id per FleetClient), so a restarted backend starting again at 1
+isn't mistaken for a resend.
+
+The queue is held in memory: events not yet acknowledged when the backend
+stops are lost.
+
+Backpressure: the local queue is bounded. When it is full, record() refuses
+new events (counted in `rejected`) instead of growing without limit, and a
+503 from the collector makes the sender back off for the time it asks.
+
+A batch the collector rejects outright (a 4xx other than 408/429) would fail
+the same way forever, so it is dropped and noted in `dead_letters` rather
+than blocking everything queued behind it. On 413 the batch is first split
+in half until a single event is still too large.
+"""
+import collections
+import email.utils
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import uuid
+import urllib.request
+import zlib
+
+
+def retry_after_seconds(value, default, limit=300.0):
+    """Parses a Retry-After header (seconds or an HTTP date); `default` if missing or unreadable."""
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return default
+    return min(max(seconds, 0.0), limit)
+
+
+class FleetClient:
+    def __init__(self, url, box_id=None, batch_size=500, flush_interval=1.0, max_pending=50000, timeout=5.0):
+        self.url = url.rstrip("/")
+        self.box_id = box_id or os.getenv("BOX_ID") or socket.gethostname()
+        self.stream = uuid.uuid4().hex[:16]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self._pending = collections.deque()  # (seq, time, type, data), oldest first
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()  # Interrupts backoff waits on stop()
+        self._next_seq = 1
+        self._running = False
+        self._thread = None
+
+        self.acked_seq = 0
+        self.sent_batches = 0
+        self.retries = 0
+        self.rejected = 0
+        self.dropped = 0  # Events in batches the collector refused
+        self.dead_letters = collections.deque(maxlen=20)  # {"first_seq", "last_seq", "error"} of dropped batches
+        self._send_size = batch_size  # Halved on 413
+        self.connected = False
+        self.last_error = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="fleet-client", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, flush_timeout=5.0):
+        # Give the sender a chance to empty the queue before shutting down
+        deadline = time.monotonic() + flush_timeout
+        while self.pending() and time.monotonic() < deadline and self.connected:
+            self._wakeup.set()
+            time.sleep(0.05)
+        self._running = False
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=flush_timeout)
+
+    def record(self, event_type, timestamp=None, data=None):
+        """Queues one event. Returns False (and drops it) when the queue is full."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                return False
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending.append((seq, round(timestamp if timestamp is not None else time.time(), 4), event_type, data))
+            full_batch = len(self._pending) >= self.batch_size
+        if full_batch:
+            self._wakeup.set()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        return {
+            "box_id": self.box_id,
+            "stream": self.stream,
+            "connected": self.connected,
+            "pending": self.pending(),
+            "acked_seq": self.acked_seq,
+            "sent_batches": self.sent_batches,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "dead_letters": list(self.dead_letters),
+            "last_error": self.last_error,
+        }
+
+    def _next_batch(self):
+        with self._lock:
+            count = min(self._send_size, len(self._pending))
+            return [self._pending[i] for i in range(count)]
+
+    def _ack(self, seq):
+        with self._lock:
+            while self._pending and self._pending[0][0] <= seq:
+                self._pending.popleft()
+        self.acked_seq = max(self.acked_seq, seq)
+
+    def _drop(self, batch, error):
+        with self._lock:
+            while self._pending and self._pending[0][0] <= batch[-1][0]:
+                self._pending.popleft()
+        self.dropped += len(batch)
+        self.dead_letters.append({"first_seq": batch[0][0], "last_seq": batch[-1][0], "error": error})
+        print(f"Fleet collector refused events {batch[0][0]}-{batch[-1][0]} ({error}), dropped")
+
+
+    def _post(self, batch):
+        body = zlib.compress(json.dumps({"box": self.box_id, "stream": self.stream, "events": batch}, separators=(",", ":")).encode(), 6)
+        request = urllib.request.Request(
+            f"{self.url}/ingest",
+            data=body,
+            method="POST",
+            headers={"Content-Type": "application/json", "Content-Encoding": "deflate", "X-Box-Id": self.box_id},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def _run(self):
+        backoff = 0.5
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while self._running:
+                batch = self._next_batch()
+                if not batch:
+                    break
+                try:
+                    reply = self._post(batch)
+                except urllib.error.HTTPError as e:
+                    self.connected = e.code != 503
+                    self.last_error = f"HTTP {e.code}"
+                    if e.code == 413 and len(batch) > 1:
+                        self._send_size = max(1, len(batch) // 2)  # Retry straight away in smaller pieces
+                        continue
+                    if 400 <= e.code < 500 and e.code not in (408, 429):
+                        self._drop(batch, self.last_error)  # Would be refused again however often it is resent
+                        continue
+                    retry_after = e.headers.get("Retry-After") if e.headers else None
+                    delay = retry_after_seconds(retry_after, backoff)
+                    self.retries += 1
+                    backoff = min(backoff * 2, 30.0)
+                    self._stopping.wait(delay)
+                    continue
+                except (OSError, ValueError) as e:
+                    # Collector unreachable: keep everything and retry the same batch later
+                    self.connected = False
+                    self.last_error = str(e)
+                    self.retries += 1
+                    self._stopping.wait(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+                self.connected = True
+                self.sent_batches += 1
+                ack = int(reply.get("ack", 0))
+                if ack < batch[0][0]:
+                    # The collector didn't take this batch; don't spin resending it
+                    self.last_error = f"collector acked {ack}, expected at least {batch[0][0]}"
+                    self.retries += 1
+                    self._stopping.wait(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+                self.last_error = None
+                backoff = 0.5
+                self._send_size = self.batch_size
+                self._ack(ack)
@@ -1,4 +1,5 @@
 import os
+import time
 
 GPIO_MODE = os.getenv("GPIO_MODE", "mock")
 
@@ -31,3 +32,130 @@ else:
 
         def color(self, value):
             print(f"[GPIO MOCK] RGBLED color set to {value}")
+
+
+class InputPolicy:
+    """
+    Software conditioning rules for one input.
+
+    debounce_s:   edges closer than this to the previous raw edge are contact bounce
+    min_hold_s:   a press only counts if the input stays active this long; such
+                  presses are delivered on release, stamped with the press time
+    refractory_s: after an accepted press, further presses are ignored this long
+    """
+    def __init__(self, debounce_s=0.02, min_hold_s=0.0, refractory_s=0.0):
+        self.debounce_s = debounce_s
+        self.min_hold_s = min_hold_s
+        self.refractory_s = refractory_s
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            debounce_s=float(data.get("debounce_s", 0.02)),
+            min_hold_s=float(data.get("min_hold_s", 0.0)),
+            refractory_s=float(data.get("refractory_s", 0.0)),
+        )
+
+    def as_dict(self):
+        return {"debounce_s": self.debounce_s, "min_hold_s": self.min_hold_s, "refractory_s": self.refractory_s}
+
+
+class InputConditioner:
+    """
+    Filters raw press/release edges for one input according to an InputPolicy.
+
+    press()/release() are called from the GPIO callback thread with the edge
+    time and return the press time when a press is accepted, otherwise None.
+    Rejected edges are only counted, so they never reach the rest of the
+    pipeline (event ring, database, trial logic).
+    """
+    def __init__(self, policy=None):
+        self.policy = policy or InputPolicy()
+        self._last_edge = None  # Time of the last raw edge, pressed or released
+        self._last_accepted = None
+        self._pressed_at = None  # Pending press waiting for min_hold_s
+        self.accepted = 0
+        self.rejected = {"bounce": 0, "refractory": 0, "short_hold": 0}
+
+    def _is_bounce(self, t):
+        bounce = self._last_edge is not None and t - self._last_edge < self.policy.debounce_s
+        self._last_edge = t
+        return bounce
+
+    def _accept(self, pressed_at):
+        if self._last_accepted is not None and pressed_at - self._last_accepted < self.policy.refractory_s:
+            self.rejected["refractory"] += 1
+            return None
+        self._last_accepted = pressed_at
+        self.accepted += 1
+        return pressed_at
+
+    def press(self, t):
+        if self._is_bounce(t):
+            self.rejected["bounce"] += 1
+            return None
+        if self.policy.min_hold_s > 0:
+            self._pressed_at = t
+            return None
+        return self._accept(t)
+
+    def release(self, t):
+        if self._is_bounce(t):
+            # A bounce on release leaves any pending press in place
+            return None
+        pressed_at, self._pressed_at = self._pressed_at, None
+        if pressed_at is None:
+            return None
+        if t - pressed_at < self.policy.min_hold_s:
+            self.rejected["short_hold"] += 1
+            return None
+        return self._accept(pressed_at)
+
+    def stats(self):
+        return {"accepted": self.accepted, "rejected": dict(self.rejected), "policy": self.policy.as_dict()}
+
+
+class ConditionedButton:
+    """
+    A Button whose presses pass through an InputConditioner before reaching
+    when_pressed. Hardware debouncing is turned off; the software policy
+    replaces it so every input can have its own windows and rejection counts.
+
+    when_pressed is called with the accepted press time on `clock`, which
+    with min_hold_s is earlier than the release that delivers it.
+
+    button_class defaults to this module's Button (a mock unless GPIO_MODE=real).
+    Scripts that always drive the real pins pass gpiozero.Button.
+    """
+    def __init__(self, pin, policy=None, clock=time.monotonic, button_class=None, **kwargs):
+        kwargs.pop("bounce_time", None)
+        self.device = (button_class or Button)(pin, **kwargs)
+        self.conditioner = InputConditioner(policy)
+        self.clock = clock
+        self.when_pressed = None
+        # Edges for one pin arrive on the pin factory's callback thread, so the
+        # conditioner is only ever touched from that one thread
+        self.device.when_pressed = self._on_press
+        self.device.when_released = self._on_release
+
+    @property
+    def policy(self):
+        return self.conditioner.policy
+
+    @policy.setter
+    def policy(self, policy):
+        self.conditioner.policy = policy
+
+    def _deliver(self, accepted):
+        callback = self.when_pressed
+        if accepted is not None and callback is not None:
+            callback(accepted)
+
+    def _on_press(self):
+        self._deliver(self.conditioner.press(self.clock()))
+
+    def _on_release(self):
+        self._deliver(self.conditioner.release(self.clock()))
+
+    def stats(self):
+        return self.conditioner.stats()
@@ -1,10 +1,11 @@
 from gpiozero import Button, LED, RGBLED
+from gpio_adapter import ConditionedButton, InputPolicy
 from time import sleep
 from signal import pause
 
-# Initialize buttons with pull-down resistors
-button1 = Button(4, pull_up=False)
-button2 = Button(18, pull_up=False)
+# Initialize buttons with pull-down resistors and software debouncing
+button1 = ConditionedButton(4, InputPolicy(debounce_s=0.05), button_class=Button, pull_up=False)
+button2 = ConditionedButton(18, InputPolicy(debounce_s=0.05), button_class=Button, pull_up=False)
 
 # Initialize single-color LEDs
 led1 = LED(24)
@@ -14,11 +15,11 @@ led2 = LED(5)
 rgb_led = RGBLED(red=12, green=16, blue=20)
 
 # === BUTTON CALLBACK FUNCTIONS ===
-def button1_pressed():
+def button1_pressed(pressed_at):
     print("[BUTTON] Button 1 Pressed! Toggling LED 1.")
     led1.toggle()
 
-def button2_pressed():
+def button2_pressed(pressed_at):
     print("[BUTTON] Button 2 Pressed! Toggling LED 2.")
     led2.toggle()
 
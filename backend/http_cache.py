@@ -0,0 +1,48 @@
+import os
+import time
+
+from flask import current_app, make_response, request
+
+# Changes every time the backend starts, so version counters that restart at
+# zero never produce an ETag a client saw from a previous run
+BOOT_ID = format(time.time_ns() & 0xFFFFFFFFFF, "x")
+
+# Clients may keep the body but must revalidate with If-None-Match every time
+REVALIDATE = "no-cache"
+
+
+def version_etag(name, version):
+    """ETag for in-memory data that carries a version/generation counter."""
+    return f"{name}-{BOOT_ID}-{version}"
+
+
+def file_etag(path):
+    """ETag for a file on disk, from its modification time and size."""
+    st = os.stat(path)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def is_fresh(etag):
+    """True if the request's If-None-Match already names this ETag."""
+    return etag in request.if_none_match
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = REVALIDATE
+    return response
+
+
+def not_modified(etag):
+    """Empty 304 response carrying the ETag."""
+    return with_etag(current_app.response_class(status=304), etag)
+
+
+def conditional(etag, build):
+    """
+    Returns 304 if the client already has `etag`, otherwise calls build() for
+    the full response and tags it. build() may return anything a view can.
+    """
+    if is_fresh(etag):
+        return not_modified(etag)
+    return with_etag(make_response(build()), etag)
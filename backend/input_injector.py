@@ -0,0 +1,181 @@
+"""
+Batch input injection for load-testing the input pipeline.
+
+One request describes a whole schedule of simulated presses, either as
+explicit events
+
+    {"events": [{"type": "lever", "at_ms": 0}, {"type": "nose_poke", "at_ms": 5}, ...]}
+
+or as a rate
+
+    {"type": "lever", "rate": 500, "duration_s": 10}     (type may also be "both")
+
+and an injector thread pushes them into BoxCore's event pipeline at that
+pace. For each run it reports the achieved rate, how late each push was
+against its schedule, and the latency from push until the consumer thread
+applied the event. Injected events carry the INJECTED flag in their code, so
+only they are timed; real presses and /api/input events applied during a run
+are not.
+
+Pushes wait on an Event without busy-waiting, so the injector doesn't hold
+the GIL away from the input threads it is measuring.
+"""
+import threading
+import time
+
+from event_ring import INJECTED, LEVER_PRESS, NOSE_POKE
+from latency_stats import percentile
+
+MAX_EVENTS = 100000
+MAX_DURATION_S = 300.0
+
+EVENT_TYPES = {"lever": LEVER_PRESS, "nose_poke": NOSE_POKE}
+
+
+class InjectionError(ValueError):
+    pass
+
+
+def parse_injection(data):
+    """Returns the schedule as a sorted list of (offset_s, code). Raises InjectionError."""
+    if not isinstance(data, dict):
+        raise InjectionError("expected a JSON object")
+    if "events" in data:
+        events = data["events"]
+        if not isinstance(events, list) or not events:
+            raise InjectionError("events must be a non-empty list")
+        if len(events) > MAX_EVENTS:
+            raise InjectionError(f"at most {MAX_EVENTS} events per run")
+        schedule = []
+        for index, event in enumerate(events):
+            if not isinstance(event, dict) or event.get("type") not in EVENT_TYPES:
+                raise InjectionError(f"event {index}: type must be one of {sorted(EVENT_TYPES)}")
+            at_ms = event.get("at_ms", 0)
+            if isinstance(at_ms, bool) or not isinstance(at_ms, (int, float)) or not 0 <= at_ms <= MAX_DURATION_S * 1000:
+                raise InjectionError(f"event {index}: at_ms must be between 0 and {int(MAX_DURATION_S * 1000)}")
+            schedule.append((at_ms / 1000.0, EVENT_TYPES[event["type"]]))
+        schedule.sort(key=lambda item: item[0])
+        return schedule
+
+    rate = data.get("rate")
+    duration = data.get("duration_s")
+    kind = data.get("type", "lever")
+    for name, value in (("rate", rate), ("duration_s", duration)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise InjectionError(f"{name} must be a positive number (or send an events list)")
+    if duration > MAX_DURATION_S:
+        raise InjectionError(f"duration_s must be at most {MAX_DURATION_S:g}")
+    count = int(rate * duration)
+    if count < 1 or count > MAX_EVENTS:
+        raise InjectionError(f"rate * duration_s must give between 1 and {MAX_EVENTS} events")
+    if kind == "both":
+        codes = (LEVER_PRESS, NOSE_POKE)
+    elif kind in EVENT_TYPES:
+        codes = (EVENT_TYPES[kind],)
+    else:
+        raise InjectionError(f"type must be one of {sorted(EVENT_TYPES) + ['both']}")
+    return [(i / rate, codes[i % len(codes)]) for i in range(count)]
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Nearest-rank percentiles in milliseconds, plus max and count."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    summary = {f"p{p}": round(percentile(ordered, p) * 1000, 3) for p in points}
+    summary["max"] = round(ordered[-1] * 1000, 3)
+    summary["count"] = len(ordered)
+    return summary
+
+
+class InjectionRun:
+    def __init__(self, run_id, schedule, push, clock=time.time):
+        self.id = run_id
+        self.schedule = schedule
+        self.push = push
+        self.clock = clock
+        self.state = "running"
+        self.pushed = 0
+        self.dropped = 0
+        self.started = None
+        self.finished = None
+        self.schedule_lag = []  # Seconds each push was behind its deadline
+        self.latencies = []  # Seconds from push until the consumer applied the event
+        self.cancelled = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        self.started = self.clock()
+        for offset, code in self.schedule:
+            deadline = start + offset
+            remaining = deadline - time.perf_counter()
+            if remaining > 0 and self.cancelled.wait(remaining):
+                break
+            if self.cancelled.is_set():
+                break
+            if self.push(code | INJECTED):
+                self.pushed += 1
+            else:
+                self.dropped += 1
+            self.schedule_lag.append(time.perf_counter() - deadline)
+        self.finished = self.clock()
+        self.state = "cancelled" if self.cancelled.is_set() else "finished"
+
+    def observe(self, stamp):
+        # Called on the consumer thread for each applied injected event. After the
+        # run ends, only events it pushed that were still queued are counted.
+        if self.started is None or stamp < self.started:
+            return
+        if self.state == "running" or len(self.latencies) < self.pushed:
+            self.latencies.append(self.clock() - stamp)
+
+    def stats(self):
+        elapsed = ((self.finished or self.clock()) - self.started) if self.started else 0.0
+        return {
+            "id": self.id,
+            "state": self.state,
+            "requested": len(self.schedule),
+            "pushed": self.pushed,
+            "dropped": self.dropped,
+            "applied": len(self.latencies),
+            "elapsed_s": round(elapsed, 4),
+            "requested_rate": round((len(self.schedule) - 1) / self.schedule[-1][0], 1) if self.schedule[-1][0] > 0 else None,
+            "achieved_rate": round(self.pushed / elapsed, 1) if elapsed > 0 else None,
+            "schedule_lag_ms": percentiles(self.schedule_lag),
+            "latency_ms": percentiles(self.latencies),
+        }
+
+
+class Injector:
+    """Runs one injection at a time; `push(code)` feeds the event pipeline."""
+    def __init__(self, push):
+        self.push = push
+        self.current = None
+        self._run_id = 0
+        self._lock = threading.Lock()
+
+    def start(self, schedule):
+        """Starts a run and returns its id, or None if one is still running."""
+        with self._lock:
+            if self.current is not None and self.current.state == "running":
+                return None
+            self._run_id += 1
+            self.current = InjectionRun(self._run_id, schedule, self.push)
+            threading.Thread(target=self.current.run, name="input-injector", daemon=True).start()
+            return self._run_id
+
+    def cancel(self):
+        run = self.current
+        if run is not None and run.state == "running":
+            run.cancelled.set()
+            return True
+        return False
+
+    def observe(self, stamp):
+        run = self.current
+        if run is not None:
+            run.observe(stamp)
+
+    def stats(self):
+        run = self.current
+        return run.stats() if run is not None else {"state": "idle"}
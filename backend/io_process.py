@@ -0,0 +1,329 @@
+"""
+Runs the hardware core (BoxCore) in its own process.
+
+The web process and the I/O process share two channels:
+
+* a small shared-memory segment the I/O process writes counters and status
+  into, which the web process reads without any round trip, and
+* a pipe carrying commands for outputs and simulated inputs, and the
+  replies to the calls that return data. Requests carry an id the reply
+  echoes, so a reply that arrives after its request timed out is dropped
+  instead of being handed to the next caller.
+
+The child is a fresh interpreter running this file, not a fork of the web
+process. Forking a process that already runs waitress and supervisor
+threads can leave the child blocked on a lock another thread held at fork
+time, and multiprocessing's spawn and forkserver would re-import the web
+app's entry module in the child.
+
+The client supervises the child: if it exits or its heartbeat stops, it is
+restarted (with backoff if it keeps dying). Counters start from zero in the
+new process; the counts generation gets a new base so ETags never repeat.
+
+GPIO callbacks, the event consumer and the outputs then run under their own
+interpreter and GIL, so a slow request in the web process (e.g. an Excel
+export) can't delay event capture.
+"""
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Pipe, resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+
+from box_core import BoxCore
+
+# Shared status layout. `seq` is a sequence lock: the writer makes it odd
+# while updating and even when done, and readers retry if it was odd or
+# changed while they read. Two threads of the I/O process write (the event
+# consumer and the command loop), so writes are serialised by a lock.
+#   seq, generation, lever_press_count, nose_poke_count : uint64
+#   heartbeat (writer's time.time())                     : float64
+#   test_active                                          : uint64
+STATUS_FORMAT = "<QQQQdQ"
+STATUS_SIZE = struct.calcsize(STATUS_FORMAT)
+HEARTBEAT_INTERVAL = 0.5
+READ_RETRIES = 1000  # Seqlock read attempts before falling back to the last good record
+REPLY_TIMEOUT = 2.0
+SUPERVISE_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 10.0  # A child that is alive but hasn't beaten for this long is restarted
+RESTART_BACKOFF_MAX = 30.0
+GENERATION_STRIDE = 1 << 32  # Counts generation base added per restart
+
+
+class IOProcessError(RuntimeError):
+    """A request to the I/O process timed out or failed there."""
+
+
+class SharedStatus:
+    def __init__(self, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=STATUS_SIZE)
+            self.shm.buf[:STATUS_SIZE] = bytes(STATUS_SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Attaching registers the segment with this process's resource
+            # tracker, which would unlink it when the I/O process exits. The
+            # web process created it and unlinks it.
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        # A restarted writer carries on from the current seq (made even, in
+        # case the previous one died mid-update)
+        seq = struct.unpack_from("<Q", self.shm.buf, 0)[0]
+        self._values = [seq + (seq & 1), 0, 0, 0, 0.0, 0]
+        self._write_lock = threading.Lock()
+        self._last_read = (0, 0, 0, 0, 0.0, 0)
+
+    # Writer side (I/O process only)
+    def write(self, generation=None, lever=None, poke=None, heartbeat=None, test_active=None):
+        with self._write_lock:
+            values = self._values
+            for i, value in ((1, generation), (2, lever), (3, poke), (4, heartbeat), (5, test_active)):
+                if value is not None:
+                    values[i] = value
+            buf = self.shm.buf
+            values[0] += 1  # Odd: update in progress
+            struct.pack_into("<Q", buf, 0, values[0])
+            struct.pack_into(STATUS_FORMAT[0] + STATUS_FORMAT[2:], buf, 8, *values[1:])
+            values[0] += 1  # Even: consistent
+            struct.pack_into("<Q", buf, 0, values[0])
+
+    # Reader side (web process)
+    def read(self):
+        """The current record, or the last good one if no consistent read succeeds."""
+        buf = self.shm.buf
+        for _ in range(READ_RETRIES):
+            before = struct.unpack_from("<Q", buf, 0)[0]
+            if not before & 1:
+                values = struct.unpack_from(STATUS_FORMAT, buf, 0)
+                if struct.unpack_from("<Q", buf, 0)[0] == before:  # Unchanged while we read
+                    self._last_read = values
+                    return values
+            time.sleep(0)  # Let the writer finish
+        return self._last_read
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def io_main(shm_name, conn, generation_base=0, test_active=False):
+    """Runs the I/O process until the web process sends None or goes away."""
+    status = SharedStatus(shm_name)
+    status.write(generation=generation_base, lever=0, poke=0, heartbeat=time.time(), test_active=int(test_active))
+    core = BoxCore(on_counts=lambda generation, lever, poke: status.write(generation_base + generation, lever, poke))
+    core.start()
+    last_beat = time.time()
+
+    handlers = {
+        "simulate": core.simulate,
+        "led": core.set_led,
+        "rgb": core.set_rgb,
+        "test_active": lambda active: status.write(test_active=int(active)),
+        "input_stats": core.input_stats,
+        "fleet_stats": core.fleet_stats,
+        "run_timeline": core.run_timeline,
+        "cancel_timeline": core.cancel_timeline,
+        "timeline_status": core.timeline_status,
+        "start_injection": core.start_injection,
+        "cancel_injection": core.cancel_injection,
+        "injection_stats": core.injection_stats,
+        "rate_series": core.rate_series,
+        "thread_cpu_snapshot": core.thread_cpu_snapshot,
+    }
+    while True:
+        try:
+            command = conn.recv() if conn.poll(HEARTBEAT_INTERVAL) else ()
+        except (EOFError, OSError):
+            break  # The web process is gone
+        now = time.time()
+        if now - last_beat >= HEARTBEAT_INTERVAL:  # Also when busy, so a steady stream of commands isn't mistaken for a hang
+            status.write(heartbeat=now)
+            last_beat = now
+        if command is None:
+            break
+        if not command:
+            continue
+        name, args, request_id = command
+        try:
+            result, ok = handlers[name](*args), True
+        except Exception as e:
+            print(f"I/O process error in {name}: {e}")
+            result, ok = str(e), False
+        if request_id is not None:
+            conn.send((request_id, ok, result))
+    status.close()
+
+
+def main():
+    # python io_process.py <shared memory name> <pipe fd> <generation base> <test active 0|1>
+    shm_name, fd, generation_base, test_active = sys.argv[1:5]
+    io_main(shm_name, Connection(int(fd)), int(generation_base), test_active == "1")
+
+
+class IOProcessClient:
+    """
+    Web-process handle on the I/O process. Has the same methods as BoxCore,
+    so sbBackend's routes work the same in either mode.
+    """
+    def __init__(self):
+        self.status = SharedStatus()
+        self._reply_lock = threading.Lock()  # Also held while the child is replaced
+        self._send_lock = threading.Lock()  # Connection.send isn't safe from several threads
+        self.conn = None
+        self._next_id = 0
+        self._test_active = False  # Restored in a restarted child
+        self._stopping = threading.Event()
+        self.restarts = 0
+        self.process = None
+        self._started = 0.0
+
+    def _spawn(self):
+        # A fresh pipe: a child killed mid-send can leave the old one with half a message
+        with self._reply_lock, self._send_lock:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn, child_conn = Pipe()
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), self.status.name, str(child_conn.fileno()),
+                 str(self.restarts * GENERATION_STRIDE), "1" if self._test_active else "0"],
+                pass_fds=[child_conn.fileno()],
+            )
+            child_conn.close()
+            self._started = time.time()
+
+    def start(self):
+        self._spawn()
+        threading.Thread(target=self._supervise, name="io-supervisor", daemon=True).start()
+
+    def _supervise(self):
+        backoff = 1.0
+        while not self._stopping.wait(SUPERVISE_INTERVAL):
+            heartbeat = self.status.read()[4]
+            now = time.time()
+            alive = self.process.poll() is None
+            hung = alive and now - self._started > HEARTBEAT_TIMEOUT and now - heartbeat > HEARTBEAT_TIMEOUT
+            if alive and not hung:
+                if now - self._started > 60:
+                    backoff = 1.0  # Stayed up, so the next failure restarts quickly again
+                continue
+            if hung:
+                print(f"I/O process stopped beating {now - heartbeat:.0f}s ago, restarting in {backoff:.0f}s")
+                self.process.kill()
+                self.process.wait(timeout=5)
+            else:
+                print(f"I/O process exited with code {self.process.returncode}, restarting in {backoff:.0f}s")
+            if self._stopping.wait(backoff):
+                break
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+            self.restarts += 1
+            self._spawn()
+
+    def stop(self):
+        self._stopping.set()
+        try:
+            self._put(None)
+        except IOProcessError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.status.close(unlink=True)
+
+    def _put(self, command):
+        with self._send_lock:
+            try:
+                self.conn.send(command)
+            except OSError as e:
+                # The child died; the supervisor restarts it
+                raise IOProcessError(f"The I/O process is not running: {e}") from None
+
+    def _send(self, name, *args):
+        self._put((name, args, None))
+
+    def _request(self, name, *args, timeout=REPLY_TIMEOUT):
+        """Sends a command and waits for its reply. Raises IOProcessError on timeout or failure."""
+        with self._reply_lock:
+            self._next_id += 1
+            request_id = self._next_id
+            self._put((name, args, request_id))
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    if not self.conn.poll(max(0.0, deadline - time.monotonic())):
+                        raise IOProcessError(f"The I/O process did not answer {name} within {timeout}s")
+                    reply_id, ok, result = self.conn.recv()
+                except (EOFError, OSError):
+                    raise IOProcessError(f"The I/O process exited before answering {name}") from None
+                if reply_id == request_id:
+                    break
+                # Otherwise a late reply to a request that already timed out
+        if not ok:
+            raise IOProcessError(f"{name} failed in the I/O process: {result}")
+        return result
+
+    def counts(self):
+        _, generation, lever, poke, _, _ = self.status.read()
+        return generation, {"lever_press_count": lever, "nose_poke_count": poke}
+
+    def status_dict(self):
+        _, generation, lever, poke, heartbeat, test_active = self.status.read()
+        return {
+            "mode": "io-process",
+            "io_process_alive": self.process.poll() is None,
+            "io_process_restarts": self.restarts,
+            "heartbeat_age_s": round(time.time() - heartbeat, 3) if heartbeat else None,
+            "test_active": bool(test_active),
+        }
+
+    def simulate(self, code):
+        self._send("simulate", code)
+        return True
+
+    def set_led(self, name, on):
+        self._send("led", name, on)
+
+    def set_rgb(self, red, green, blue):
+        self._send("rgb", red, green, blue)
+
+    def set_test_active(self, active):
+        self._test_active = bool(active)
+        self._send("test_active", active)
+
+    def input_stats(self):
+        return self._request("input_stats")
+
+    def thread_cpu_snapshot(self):
+        return self._request("thread_cpu_snapshot")
+
+    def rate_series(self, window_s, points, method, kind):
+        return self._request("rate_series", window_s, points, method, kind)
+
+    def fleet_stats(self):
+        return self._request("fleet_stats")
+
+    def run_timeline(self, steps, replace=False):
+        return self._request("run_timeline", steps, replace)
+
+    def cancel_timeline(self):
+        return self._request("cancel_timeline")
+
+    def timeline_status(self):
+        return self._request("timeline_status")
+
+    def start_injection(self, schedule):
+        return self._request("start_injection", schedule)
+
+    def cancel_injection(self):
+        return self._request("cancel_injection")
+
+    def injection_stats(self):
+        return self._request("injection_stats")
+
+
+if __name__ == "__main__":
+    main()
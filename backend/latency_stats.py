@@ -0,0 +1,12 @@
+"""
+Percentiles for the timing reports (route timings, the trial watchdog, input
+injection runs and bench_http). They all use this one definition, so their
+p50/p95/p99 figures can be compared directly.
+"""
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank p-th percentile (0-100) of an already sorted list, or None if it is empty."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
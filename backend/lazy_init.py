@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+class StartupProfile:
+    """
+    Records how long each startup phase takes, measured from process start.
+
+    Call mark(name) at the end of each phase. Lazy resources also report the
+    time they spend initializing so slow hardware or imports show up here.
+    """
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self._last = self.t0
+        self._lock = threading.Lock()
+        self.phases = []  # (name, duration_s, since_start_s)
+
+    def mark(self, name):
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append((name, round(now - self._last, 4), round(now - self.t0, 4)))
+            self._last = now
+
+    def record(self, name, duration):
+        # For work timed on its own, e.g. a lazy init on another thread
+        with self._lock:
+            self.phases.append((name, round(duration, 4), round(time.perf_counter() - self.t0, 4)))
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "phases": [{"name": n, "duration_s": d, "at_s": a} for n, d, a in self.phases],
+                "uptime_s": round(time.perf_counter() - self.t0, 4),
+            }
+
+    def report(self):
+        for name, duration, at in list(self.phases):
+            print(f"[STARTUP] {name:<24} {duration * 1000:8.1f} ms (t={at:.3f}s)")
+
+
+class LazyResource:
+    """
+    Creates an expensive object (hardware device, DB driver, ...) on first use.
+
+    get() is safe to call from several threads; the factory runs exactly once.
+    If the factory raises, the error is re-raised and the next get() retries.
+    """
+    def __init__(self, name, factory, profile=None):
+        self.name = name
+        self._factory = factory
+        self._profile = profile
+        self._value = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                self._value = self._factory()
+                self._ready = True
+                if self._profile is not None:
+                    self._profile.record(f"init {self.name}", time.perf_counter() - start)
+        return self._value
@@ -0,0 +1,200 @@
+"""
+Compressed archive of old session logs.
+
+Logs older than a few days are rewritten as `<name>.csv.gz` in a seekable
+gzip format: the CSV is cut into blocks of 64 KiB and each block is its own
+gzip member, with the member's compressed size stored in the header's extra
+field (like BGZF). The result is still an ordinary gzip file (zcat, Excel
+importers and gzip.open read it as usual), but a reader can also skip from
+block to block by reading only headers and decompress just the part it needs.
+
+    python log_archive.py logs --days 7
+
+The backend never decompresses an archive to disk: open_log_text() and
+iter_log_bytes() stream it block by block, and BlockReader.read_range()
+serves byte ranges of the original CSV.
+"""
+import argparse
+import gzip
+import io
+import os
+import struct
+import time
+import zlib
+
+ARCHIVE_SUFFIX = ".gz"
+BLOCK_SIZE = 64 * 1024
+EXTRA_ID = b"SB"  # Extra subfield holding the member's compressed size - 1
+_HEADER = struct.Struct("<BBBBIBBH")  # ID1 ID2 CM FLG MTIME XFL OS XLEN
+_SUBFIELD = struct.Struct("<2sHI")  # SI1SI2 SLEN BSIZE
+HEADER_SIZE = _HEADER.size + _SUBFIELD.size
+
+
+def _member(data, level):
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = deflate.compress(data) + deflate.flush()
+    size = HEADER_SIZE + len(body) + 8
+    header = _HEADER.pack(0x1F, 0x8B, 8, 0x04, 0, 0, 255, _SUBFIELD.size) + _SUBFIELD.pack(EXTRA_ID, 4, size - 1)
+    return header + body + struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF)
+
+
+def compress_file(src, dst=None, block_size=BLOCK_SIZE, level=6, remove_source=True):
+    """
+    Writes `src` as a block-gzip archive (default `src` + .gz) and keeps the
+    source's modification time. The archive is checked before the source is
+    removed. Returns the archive path.
+    """
+    dst = dst or src + ARCHIVE_SUFFIX
+    tmp = dst + ".tmp"
+    crc = 0
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        while True:
+            data = fin.read(block_size)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            fout.write(_member(data, level))
+        fout.flush()
+        os.fsync(fout.fileno())
+
+    # Read the archive back before trusting it with the only copy
+    check = 0
+    for chunk in BlockReader(tmp).iter_chunks():
+        check = zlib.crc32(chunk, check)
+    if check != crc:
+        os.remove(tmp)
+        raise IOError(f"Archive of {src} failed verification")
+
+    stat = os.stat(src)
+    os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp, dst)
+    if remove_source:
+        os.remove(src)
+    return dst
+
+
+class BlockReader:
+    """Random access to a block-gzip archive. Other gzip files fall back to streaming."""
+    def __init__(self, path):
+        self.path = path
+        self.blocks = self._scan()  # [(compressed offset, uncompressed offset, uncompressed size)] or None
+        self.size = None if self.blocks is None else sum(block[2] for block in self.blocks)
+
+    def _scan(self):
+        blocks = []
+        position = 0
+        uncompressed = 0
+        file_size = os.path.getsize(self.path)
+        with open(self.path, "rb") as f:
+            while position < file_size:
+                f.seek(position)
+                header = f.read(HEADER_SIZE)
+                if len(header) < HEADER_SIZE:
+                    return None
+                id1, id2, _, flags, _, _, _, xlen = _HEADER.unpack_from(header)
+                subfield_id, _, bsize = _SUBFIELD.unpack_from(header, _HEADER.size)
+                if (id1, id2) != (0x1F, 0x8B) or not flags & 0x04 or xlen != _SUBFIELD.size or subfield_id != EXTRA_ID:
+                    return None  # Not written by compress_file
+                member_size = bsize + 1
+                f.seek(position + member_size - 4)
+                isize = struct.unpack("<I", f.read(4))[0]
+                blocks.append((position, uncompressed, isize))
+                position += member_size
+                uncompressed += isize
+        return blocks
+
+    def _read_block(self, f, index):
+        offset = self.blocks[index][0]
+        end = self.blocks[index + 1][0] if index + 1 < len(self.blocks) else None
+        f.seek(offset)
+        member = f.read(end - offset) if end is not None else f.read()
+        return zlib.decompress(member[HEADER_SIZE:-8], -zlib.MAX_WBITS)
+
+    def iter_chunks(self, start=0, end=None):
+        """Yields the uncompressed bytes from `start` up to `end`, one block at a time."""
+        if self.blocks is None:
+            yield from self._iter_plain_gzip(start, end)
+            return
+        end = self.size if end is None else min(end, self.size)
+        with open(self.path, "rb") as f:
+            for index, (_, block_start, block_size) in enumerate(self.blocks):
+                block_end = block_start + block_size
+                if block_end <= start:
+                    continue
+                if block_start >= end:
+                    break
+                data = self._read_block(f, index)
+                yield data[max(0, start - block_start):end - block_start]
+
+    def _iter_plain_gzip(self, start, end):
+        position = 0
+        with gzip.open(self.path, "rb") as f:
+            while end is None or position < end:
+                data = f.read(BLOCK_SIZE)
+                if not data:
+                    break
+                lo, hi = max(0, start - position), len(data) if end is None else min(len(data), end - position)
+                position += len(data)
+                if hi > lo:
+                    yield data[lo:hi]
+
+    def read_range(self, start, length):
+        return b"".join(self.iter_chunks(start, start + length))
+
+
+def resolve_log(log_dir, filename):
+    """
+    Finds a log by the name the UI knows it by. Returns (path, archived) or
+    (None, False). `session.csv` is served from `session.csv.gz` once archived.
+    """
+    path = os.path.join(log_dir, filename)
+    if os.path.isfile(path):
+        return path, filename.endswith(ARCHIVE_SUFFIX)
+    if os.path.isfile(path + ARCHIVE_SUFFIX):
+        return path + ARCHIVE_SUFFIX, True
+    return None, False
+
+
+def display_name(filename):
+    return filename[:-len(ARCHIVE_SUFFIX)] if filename.endswith(ARCHIVE_SUFFIX) else filename
+
+
+def open_log_text(path):
+    """Opens a log (plain or archived) for reading as text, decompressing as it goes."""
+    if path.endswith(ARCHIVE_SUFFIX):
+        return io.TextIOWrapper(gzip.open(path, "rb"), newline="")
+    return open(path, "r", newline="")
+
+
+def archive_logs(log_dir, older_than_days=7, skip=()):
+    """Compresses every .csv log not modified for `older_than_days`. Returns the archives written."""
+    cutoff = time.time() - older_than_days * 86400
+    skip = {os.path.abspath(path) for path in skip if path}
+    archived = []
+    for filename in sorted(os.listdir(log_dir)):
+        path = os.path.join(log_dir, filename)
+        if not filename.endswith(".csv") or os.path.abspath(path) in skip or not os.path.isfile(path):
+            continue
+        if os.path.getmtime(path) > cutoff:
+            continue
+        try:
+            archived.append(compress_file(path))
+        except OSError as e:
+            print(f"Could not archive {filename}: {e}")
+    return archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress old session logs")
+    parser.add_argument("log_dir", nargs="?", default=os.path.join(os.path.dirname(__file__), "logs"))
+    parser.add_argument("--days", type=float, default=7, help="Archive logs not modified for this many days")
+    args = parser.parse_args()
+
+    before = sum(os.path.getsize(os.path.join(args.log_dir, f)) for f in os.listdir(args.log_dir))
+    archived = archive_logs(args.log_dir, args.days)
+    after = sum(os.path.getsize(os.path.join(args.log_dir, f)) for f in os.listdir(args.log_dir))
+    print(f"Archived {len(archived)} logs, {before} -> {after} bytes")
+
+
+if __name__ == "__main__":
+    main()
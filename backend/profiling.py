@@ -0,0 +1,247 @@
+"""
+Opt-in profiling for the backend (set SB_PROFILING=1).
+
+Nothing here is registered unless profiling is enabled, so a normal run pays
+nothing. When enabled, register_profiling(app) adds:
+
+    GET    /admin/profile/routes             per-route request count and timing
+    DELETE /admin/profile/routes             reset the route timings
+    POST   /admin/profile/sample?seconds=10  start the sampling profiler
+    GET    /admin/profile/sample             its result as collapsed stacks, e.g.
+                                             curl .../admin/profile/sample > out.folded
+                                             flamegraph.pl out.folded > out.svg
+    GET    /admin/profile/threads?interval_s=1
+                                             CPU time (and % over the interval) per thread
+
+The sampler looks at every thread's stack (sys._current_frames) every few
+milliseconds from its own thread; nothing in the sampled threads changes.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+from flask import Response, g, jsonify, request
+
+from latency_stats import percentile
+
+
+def enabled():
+    return os.getenv("SB_PROFILING", "0") == "1"
+
+
+class RouteTimer:
+    """Request count, total/max time and recent percentiles per route."""
+    def __init__(self, recent=256):
+        self.recent = recent
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = self._stats[key] = {"count": 0, "total": 0.0, "max": 0.0, "recent": collections.deque(maxlen=self.recent)}
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["recent"].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def as_dict(self):
+        with self._lock:
+            items = [(key, dict(entry, recent=sorted(entry["recent"]))) for key, entry in self._stats.items()]
+        result = {}
+        for key, entry in sorted(items, key=lambda item: -item[1]["total"]):
+            recent = entry["recent"]
+            result[key] = {
+                "count": entry["count"],
+                "total_ms": round(entry["total"] * 1000, 3),
+                "mean_ms": round(entry["total"] / entry["count"] * 1000, 3),
+                "max_ms": round(entry["max"] * 1000, 3),
+                "p50_ms": round(percentile(recent, 50) * 1000, 3),
+                "p95_ms": round(percentile(recent, 95) * 1000, 3),
+            }
+        return result
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads for a while and counts identical stacks."""
+    def __init__(self):
+        self._thread = None
+        self._counts = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self.interval = 0.0
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=10.0, interval=0.005):
+        if self.running():
+            return False
+        self._counts = collections.Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.duration = duration
+        self.interval = interval
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        me = threading.get_ident()
+        end = time.perf_counter() + self.duration
+        while time.perf_counter() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed-stack format: one 'frame;frame;frame count' line per stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in self._counts.most_common())
+
+    def status(self):
+        return {
+            "running": self.running(),
+            "started": self.started,
+            "duration_s": self.duration,
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "stacks": len(self._counts),
+        }
+
+
+def _task_cpu_seconds():
+    # utime + stime of every thread of this process, keyed by native thread id (Linux only)
+    ticks = os.sysconf("SC_CLK_TCK")
+    times = {}
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{tid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The thread name in (...) may contain spaces, so split after it
+        fields = stat[stat.rindex(")") + 2:].split()
+        times[int(tid)] = (int(fields[11]) + int(fields[12])) / ticks
+    return times
+
+
+def thread_cpu_snapshot():
+    """CPU seconds used so far by each Python thread of this process, or None without /proc."""
+    if not os.path.isdir("/proc/self/task"):
+        return None
+    times = _task_cpu_seconds()
+    return {
+        f"{thread.name} ({thread.native_id})": times[thread.native_id]
+        for thread in threading.enumerate()
+        if thread.native_id in times
+    }
+
+
+def thread_cpu(interval=0.0, snapshot=thread_cpu_snapshot):
+    """
+    CPU seconds per thread, plus CPU % over `interval` seconds if given.
+    `snapshot` can fetch the numbers from another process.
+    """
+    before = snapshot()
+    if before is None:
+        return None
+    if interval <= 0:
+        return {name: {"cpu_s": round(cpu, 3)} for name, cpu in before.items()}
+    time.sleep(interval)
+    after = snapshot() or {}
+    return {
+        name: {"cpu_s": round(cpu, 3), "cpu_percent": round((cpu - before.get(name, cpu)) / interval * 100, 1)}
+        for name, cpu in after.items()
+    }
+
+
+def register_profiling(app, io_snapshot=None):
+    """
+    Adds the route timing hooks and the /admin/profile endpoints to `app`.
+    `io_snapshot` is a thread_cpu_snapshot for threads in another process
+    (the I/O process); its threads are reported under "io".
+    """
+    timer = RouteTimer()
+    profiler = SamplingProfiler()
+
+    @app.before_request
+    def start_route_timer():
+        g.profile_start = time.perf_counter()
+
+    @app.after_request
+    def stop_route_timer(response):
+        start = g.pop("profile_start", None)
+        if start is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            timer.record(f"{request.method} {rule}", time.perf_counter() - start)
+        return response
+
+    @app.route('/admin/profile/routes', methods=['GET'])
+    def profile_routes():
+        return jsonify(timer.as_dict())
+
+    @app.route('/admin/profile/routes', methods=['DELETE'])
+    def reset_profile_routes():
+        timer.reset()
+        return jsonify({"status": "reset"})
+
+    @app.route('/admin/profile/sample', methods=['POST'])
+    def start_sampling():
+        try:
+            seconds = float(request.args.get('seconds', 10))
+            interval_ms = float(request.args.get('interval_ms', 5))
+        except ValueError:
+            return jsonify({"error": "seconds and interval_ms must be numbers"}), 400
+        if not 0 < seconds <= 300 or not 1 <= interval_ms <= 1000:
+            return jsonify({"error": "seconds must be 0-300 and interval_ms 1-1000"}), 400
+        if not profiler.start(seconds, interval_ms / 1000.0):
+            return jsonify({"error": "The profiler is already running", **profiler.status()}), 409
+        return jsonify(profiler.status()), 202
+
+    @app.route('/admin/profile/sample', methods=['GET'])
+    def sampling_result():
+        if profiler.running():
+            return jsonify(profiler.status()), 202
+        return Response(profiler.collapsed(), mimetype='text/plain')
+
+    @app.route('/admin/profile/threads', methods=['GET'])
+    def profile_threads():
+        try:
+            interval = min(max(float(request.args.get('interval_s', 0)), 0.0), 10.0)
+        except ValueError:
+            return jsonify({"error": "interval_s must be a number"}), 400
+        if io_snapshot is None:
+            return jsonify({"web": thread_cpu(interval)})
+
+        # Measure both processes over the same interval
+        def snapshot():
+            merged = {}
+            for side, take in (("web", thread_cpu_snapshot), ("io", io_snapshot)):
+                for name, cpu in (take() or {}).items():
+                    merged[(side, name)] = cpu
+            return merged
+        usage = {"web": {}, "io": {}}
+        for (side, name), entry in (thread_cpu(interval, snapshot) or {}).items():
+            usage[side][name] = entry
+        return jsonify(usage)
+
+    print("Profiling enabled: /admin/profile/routes, /admin/profile/sample, /admin/profile/threads")
+    return timer, profiler
@@ -0,0 +1,132 @@
+"""
+Per-second event counts for live response-rate and cumulative-record charts.
+
+RateBins keeps one count per second per channel in a fixed-size ring (six
+hours by default), so memory doesn't grow with session length. series()
+cuts a window out of the ring and downsamples it to the number of points the
+chart asks for, so a response stays the same size whether the window is a
+minute or the whole session:
+
+* "minmax" keeps the lowest and highest value of each bucket (spikes survive)
+* "lttb" (largest-triangle-three-buckets) keeps the visually important points
+
+Only the consumer thread records; readers take a lock-protected copy.
+"""
+import threading
+import time
+
+import numpy as np
+
+METHODS = ("minmax", "lttb")
+KINDS = ("rate", "cumulative")
+
+
+def minmax_downsample(x, y, points):
+    """At most `points` points: the min and max of each of points // 2 buckets, in time order."""
+    n = len(x)
+    buckets = max(1, points // 2)
+    if n <= points or buckets >= n:
+        return x, y
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    keep = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        chunk = y[lo:hi]
+        a, b = lo + int(np.argmin(chunk)), lo + int(np.argmax(chunk))
+        keep.extend((a, b) if a <= b else (b, a))
+    keep = np.unique(np.array(keep))
+    return x[keep], y[keep]
+
+
+def lttb_downsample(x, y, points):
+    """Largest-triangle-three-buckets: `points` points including the first and last."""
+    n = len(x)
+    if points >= n or points < 3:
+        return x, y
+    keep = np.empty(points, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Average of the next bucket (or the last point) is the third triangle corner
+        nlo, nhi = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        if nhi <= nlo:
+            nhi = nlo + 1
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        bx, by = x[lo:hi], y[lo:hi]
+        areas = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = lo + int(np.argmax(areas))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+
+class RateBins:
+    def __init__(self, channels, capacity_s=6 * 3600, clock=time.time):
+        self.channels = tuple(channels)
+        self.capacity = capacity_s
+        self.clock = clock
+        self._bins = np.zeros((capacity_s, len(self.channels)), dtype=np.int32)
+        self._totals = np.zeros(len(self.channels), dtype=np.int64)  # All events ever recorded
+        self._latest = None  # Newest second with a bin in the ring
+        self._lock = threading.Lock()
+
+    def _advance(self, second):
+        # Zero the bins of seconds that passed without events (or wrap around)
+        if self._latest is None:
+            self._latest = second
+            return
+        gap = second - self._latest
+        if gap <= 0:
+            return
+        if gap >= self.capacity:
+            self._bins[:] = 0
+        else:
+            start = (self._latest + 1) % self.capacity
+            end = start + gap
+            if end <= self.capacity:
+                self._bins[start:end] = 0
+            else:
+                self._bins[start:] = 0
+                self._bins[:end - self.capacity] = 0
+        self._latest = second
+
+    def record(self, channel, stamp):
+        second = int(stamp)
+        index = self.channels.index(channel)
+        with self._lock:
+            self._advance(second)
+            if second > self._latest - self.capacity:  # Too old events only count towards the total
+                self._bins[second % self.capacity, index] += 1
+            self._totals[index] += 1
+
+    def window(self, seconds):
+        """Returns (first second, counts array shaped (seconds, channels), totals before the window)."""
+        seconds = max(1, min(int(seconds), self.capacity))
+        now = int(self.clock())
+        with self._lock:
+            self._advance(now)
+            first = self._latest - seconds + 1
+            rows = np.arange(first, self._latest + 1) % self.capacity
+            counts = self._bins[rows].copy()
+            before = self._totals - counts.sum(axis=0)
+        return first, counts, before
+
+    def series(self, window_s=600, points=300, method="minmax", kind="rate"):
+        """Downsampled [[t, value], ...] per channel for the last `window_s` seconds."""
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}")
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}")
+        first, counts, before = self.window(window_s)
+        x = np.arange(first, first + len(counts), dtype=np.float64)
+        downsample = minmax_downsample if method == "minmax" else lttb_downsample
+        result = {"start": first, "end": first + len(counts) - 1, "method": method, "kind": kind, "series": {}}
+        for i, channel in enumerate(self.channels):
+            y = counts[:, i].astype(np.float64)
+            if kind == "cumulative":
+                y = np.cumsum(y) + before[i]
+            sx, sy = downsample(x, y, max(2, int(points)))
+            result["series"][channel] = [[int(t), float(v)] for t, v in zip(sx, sy)]
+        return result
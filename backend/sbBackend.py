@@ -1,10 +1,18 @@
+from lazy_init import StartupProfile
+startup = StartupProfile()
+
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from gpio_adapter import Button, LED, RGBLED
+from box_core import BoxCore
+from event_ring import LEVER_PRESS, NOSE_POKE
+from http_cache import conditional, version_etag, REVALIDATE
+from output_timeline import parse_timeline, TimelineError
+from input_injector import parse_injection, InjectionError
+from rate_series import METHODS, KINDS
+import profiling
 import time
-import threading
 import os
-import sqlite3
+startup.mark("imports")
 
 file = "testdatabase.db"  ## for database
 
@@ -16,69 +24,34 @@ CORS(app)  # Allow all domains for development
 log_directory = os.path.join(os.path.dirname(__file__), 'logs')
 temp_directory = os.path.join(os.path.dirname(__file__), 'temp')
 
-# Initialize buttons (with pull-down resistors)
-lever_press_button = Button(4, pull_up=False)
-nose_poke_button = Button(18, pull_up=False)
-
-# Initialize LEDs
-blue_led = LED(5)
-orange_led = LED(24)
-rgb_led = RGBLED(red=12, green=16, blue=20)
-
-# Global counters for interactions
-lever_press_count = 0
-nose_poke_count = 0
-counter_lock = threading.Lock()
-
-# Helper function to get a new SQLite connection
-def get_db_connection():
-    return sqlite3.connect("testdatabase.db")
-
-# Callback functions to count button presses
-def on_lever_press():
-    global lever_press_count
-    with counter_lock:
-        lever_press_count += 1
-        print("Lever pressed. Count:", lever_press_count)
-
-    # Use a new connection inside the callback
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE TestDB SET "Lever Presses Actual" = "Lever Presses Actual" + 1')
-        conn.commit()
-        print("Data updated - Lever Press") 
-    except Exception as e:
-        print(f"Database error on lever press: {e}")
-    finally:
-        conn.close()
-
-def on_nose_poke():
-    global nose_poke_count
-    with counter_lock:
-        nose_poke_count += 1
-        print("Nose poke. Count:", nose_poke_count)
-
-    # Use a new connection inside the callback
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE TestDB SET "Nose Poke Actual" = "Nose Poke Actual" + 1')
-        conn.commit()
-        print("Data updated - Nose Poke")
-    except Exception as e:
-        print(f"Database error on nose poke: {e}")
-    finally:
-        conn.close()
-
-# Re-register callbacks to ensure they remain active
-lever_press_button.when_pressed = on_lever_press
-nose_poke_button.when_pressed = on_nose_poke
-
-
-# Disable caching to ensure React always gets fresh data
+# The hardware core (buttons, LEDs, interaction counters). With SB_IO_PROCESS=1
+# it runs in its own process and is reached through shared memory and a
+# pipe (see io_process.py), so web requests can't delay input capture.
+if os.getenv("SB_IO_PROCESS", "0") == "1":
+    from io_process import IOProcessClient, IOProcessError
+    core = IOProcessClient()
+    io_threads = core.thread_cpu_snapshot  # Profiling reports the I/O process's threads too
+
+    @app.errorhandler(IOProcessError)
+    def io_process_error(e): # A request to the I/O process timed out or failed there
+        return jsonify({"error": str(e)}), 503
+else:
+    core = BoxCore(startup)
+    io_threads = None
+core.start()
+if profiling.enabled():
+    # Route timing and /admin/profile endpoints (SB_PROFILING=1)
+    profiling.register_profiling(app, io_threads)
+startup.mark("module loaded")
+
+
+# Disable caching to ensure React always gets fresh data. Responses with an
+# ETag may be kept, but the browser has to revalidate them on every request.
 @app.after_request
 def add_header(response):
+    if response.headers.get('ETag'):
+        response.headers['Cache-Control'] = REVALIDATE
+        return response
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
@@ -88,25 +61,58 @@ def add_header(response):
 def index():
     return "Backend is running!"
 
+# Endpoint to see how long each startup phase took
+@app.route('/startup-profile', methods=['GET'])
+def startup_profile():
+    return jsonify(startup.as_dict()), 200
+
 # Endpoint to retrieve counts
 @app.route('/counts', methods=['GET'])
 def get_counts():
-    with counter_lock:
-        counts = {
-            "lever_press_count": lever_press_count,
-            "nose_poke_count": nose_poke_count
-        }
-    return jsonify(counts), 200
+    generation, counts = core.counts()
+    # Unchanged counts cost the poller only a 304
+    return conditional(version_etag("counts", generation), lambda: (jsonify(counts), 200))
+
+# Endpoint for the live charts: per-second lever/poke counts over the last
+# window_s seconds, downsampled to about `points` points per series, e.g.
+#   /counts/series?window_s=3600&points=300&method=lttb&kind=cumulative
+@app.route('/counts/series', methods=['GET'])
+def get_count_series():
+    try:
+        window_s = int(request.args.get('window_s', 600))
+        points = int(request.args.get('points', 300))
+    except ValueError:
+        return jsonify({"error": "window_s and points must be integers"}), 400
+    method = request.args.get('method', 'minmax')
+    kind = request.args.get('kind', 'rate')
+    if method not in METHODS or kind not in KINDS or window_s < 1 or not 2 <= points <= 5000:
+        return jsonify({"error": f"method must be one of {list(METHODS)}, kind one of {list(KINDS)}, window_s >= 1 and points 2-5000"}), 400
+    return jsonify(core.rate_series(window_s, points, method, kind)), 200
+
+# Endpoint to see how many raw edges the input conditioning discarded
+@app.route('/inputs/stats', methods=['GET'])
+def get_input_stats():
+    return jsonify(core.input_stats()), 200
+
+# Endpoint to check where the hardware core runs and whether it is alive
+@app.route('/io/status', methods=['GET'])
+def get_io_status():
+    return jsonify(core.status_dict()), 200
+
+# Endpoint to check the connection to the fleet collector (FLEET_URL)
+@app.route('/fleet/status', methods=['GET'])
+def get_fleet_status():
+    stats = core.fleet_stats()
+    if stats is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(stats, enabled=True)), 200
 
 # Endpoint to control the Blue LED
 @app.route('/light/blue', methods=['POST'])
 def control_blue():
     data = request.get_json()
     action = data.get("action", "off")
-    if action == "on":
-        blue_led.on()
-    else:
-        blue_led.off()
+    core.set_led("blue", action == "on")
     return jsonify({"status": "success", "blue": action}), 200
 
 # Endpoint to control the Orange LED
@@ -114,10 +120,7 @@ def control_blue():
 def control_orange():
     data = request.get_json()
     action = data.get("action", "off")
-    if action == "on":
-        orange_led.on()
-    else:
-        orange_led.off()
+    core.set_led("orange", action == "on")
     return jsonify({"status": "success", "orange": action}), 200
 
 # Endpoint to control the RGB LED
@@ -130,10 +133,35 @@ def control_rgb():
     blue_val = 1 if data.get("blue", "off") == "on" else 0
 
     # Set the overall color using a tuple (r, g, b)
-    rgb_led.color = (red_val, green_val, blue_val)
+    core.set_rgb(red_val, green_val, blue_val)
     
     return jsonify({"status": "success", "rgb": {"red": data.get("red", "off"), "green": data.get("green", "off"), "blue": data.get("blue", "off")}}), 200
 
+# Endpoint to run a list of timed output commands as one sequence, e.g.
+#   {"commands": [{"device": "blue", "value": "on", "at_ms": 0},
+#                 {"device": "blue", "value": "off", "at_ms": 500}]}
+# The whole list is validated before anything runs. Send "replace": true to
+# stop a sequence that is still playing instead of getting a 409.
+@app.route('/outputs/timeline', methods=['POST'])
+def run_output_timeline():
+    data = request.get_json(silent=True) or {}
+    try:
+        steps = parse_timeline(data.get("commands"))
+    except TimelineError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    run_id = core.run_timeline(steps, bool(data.get("replace", False)))
+    if run_id is None:
+        return jsonify({"status": "error", "message": "A timeline is already running"}), 409
+    return jsonify({"status": "started", "id": run_id, "steps": len(steps), "duration_ms": round(steps[-1][0] * 1000, 3)}), 202
+
+@app.route('/outputs/timeline', methods=['GET'])
+def get_output_timeline():
+    return jsonify(core.timeline_status()), 200
+
+@app.route('/outputs/timeline', methods=['DELETE'])
+def cancel_output_timeline():
+    return jsonify({"cancelled": core.cancel_timeline()}), 200
+
 # Routes to run tests
 @app.route('/test/run', methods=['POST'])
 def run_test():
@@ -143,9 +171,10 @@ def run_test():
 
         # Perform any test logic here
         # Example: Activate LED as a placeholder for actual test execution
-        blue_led.on()
+        core.set_test_active(True)
+        core.set_led("blue", True)
         time.sleep(2)  # Simulate test running
-        blue_led.off()
+        core.set_led("blue", False)
 
         return jsonify({"message": "Test started successfully!"}), 200
     except Exception as e:
@@ -154,15 +183,52 @@ def run_test():
 
 @app.route("/api/input/lever", methods=["POST"])
 def simulate_lever_press():
-    on_lever_press()
+    core.simulate(LEVER_PRESS)
     return jsonify({"status": "simulated lever press"}), 200
 
 
 @app.route("/api/input/nosepoke", methods=["POST"])
 def simulate_nose_poke():
-    on_nose_poke()
+    core.simulate(NOSE_POKE)
     return jsonify({"status": "simulated nose poke"}), 200
 
+# Load-test endpoint: inject a whole schedule of simulated presses in one
+# request (see input_injector.py for the body format). With "wait": true the
+# response comes after the run with its achieved rate and latency stats;
+# otherwise poll GET /api/input/batch.
+INJECTION_WAIT_LIMIT = 60.0
+
+@app.route("/api/input/batch", methods=["POST"])
+def inject_input_batch():
+    data = request.get_json(silent=True)
+    try:
+        schedule = parse_injection(data)
+    except InjectionError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    run_id = core.start_injection(schedule)
+    if run_id is None:
+        return jsonify({"status": "error", "message": "An injection run is already in progress"}), 409
+    if not data.get("wait") or schedule[-1][0] > INJECTION_WAIT_LIMIT:
+        return jsonify({"status": "started", "id": run_id, "events": len(schedule)}), 202
+
+    deadline = time.monotonic() + schedule[-1][0] + 5.0
+    stats = core.injection_stats()
+    while time.monotonic() < deadline:
+        # Done once every push has happened and the consumer has caught up
+        if stats["state"] != "running" and stats["applied"] >= stats["pushed"]:
+            break
+        time.sleep(0.05)
+        stats = core.injection_stats()
+    return jsonify(stats), 200
+
+@app.route("/api/input/batch", methods=["GET"])
+def get_input_batch():
+    return jsonify(core.injection_stats()), 200
+
+@app.route("/api/input/batch", methods=["DELETE"])
+def cancel_input_batch():
+    return jsonify({"cancelled": core.cancel_injection()}), 200
+
 
 @app.route('/test/stop', methods=['POST'])
 def stop_test():
@@ -170,7 +236,8 @@ def stop_test():
         print("Stopping test...")
 
         # Logic to stop test (if applicable)
-        blue_led.off()  # Example: turn off LED to indicate stop
+        core.set_led("blue", False)  # Example: turn off LED to indicate stop
+        core.set_test_active(False)
 
         return jsonify({"message": "Test stopped successfully!"}), 200
     except Exception as e:
@@ -180,7 +247,9 @@ def stop_test():
 
 if __name__ == '__main__':
     # Run with sudo (if needed) to access GPIO and on a chosen port (e.g., 5001)
-    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
+    startup.mark("ready to serve")
+    startup.report()
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
 
 """
 from flask import Flask, jsonify, request
@@ -0,0 +1,74 @@
+"""
+Production entry point for the backend.
+
+Serves the Flask app with waitress, a multi-threaded WSGI server, instead of
+Flask's development server. Everything runs in ONE process: the GPIO devices
+and the event consumer are owned by this process, and HTTP requests are
+handled concurrently on waitress' worker threads.
+
+If the app module defines start_backend(), it is called once before serving.
+
+Settings (command line flags override environment variables):
+    SB_APP          module that defines `app`        (default: sbBackend)
+    SB_SERVER       waitress | dev                   (default: waitress)
+    HOST / PORT     bind address                     (default: 0.0.0.0:5000)
+    WEB_THREADS     request worker threads           (default: 8)
+    WEB_CONNECTIONS max open connections             (default: 100)
+    WEB_BACKLOG     listen backlog                   (default: 128)
+    WEB_TIMEOUT     seconds before idle connections are closed (default: 60)
+
+    python serve.py
+    python serve.py --threads 16
+    python serve.py --server dev    # Flask dev server, for comparison
+"""
+import argparse
+import importlib
+import os
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default=os.getenv("SB_APP", "sbBackend"))
+    parser.add_argument("--server", choices=["waitress", "dev"], default=os.getenv("SB_SERVER", "waitress"))
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 5000)))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WEB_THREADS", 8)))
+    parser.add_argument("--connections", type=int, default=int(os.getenv("WEB_CONNECTIONS", 100)))
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("WEB_BACKLOG", 128)))
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("WEB_TIMEOUT", 60)))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    module = importlib.import_module(args.app)
+    app = module.app
+    start_backend = getattr(module, "start_backend", None)
+    if start_backend is not None:
+        start_backend()
+
+    startup = getattr(module, "startup", None)
+    if startup is not None:
+        startup.mark("ready to serve")
+        startup.report()
+
+    if args.server == "dev":
+        app.run(debug=False, use_reloader=False, threaded=True, host=args.host, port=args.port)
+        return
+
+    from waitress import serve
+    print(f"Serving {args.app} with waitress on {args.host}:{args.port} ({args.threads} threads)")
+    serve(
+        app,
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        connection_limit=args.connections,
+        backlog=args.backlog,
+        channel_timeout=args.timeout,
+        ident="skinnerbox",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Columnar long-term store of finished sessions.
+
+The session CSVs mix one summary row with the detail rows and have to be
+parsed in full for any question about the past. compact_sessions() rolls
+them into typed numpy column files, partitioned by month and subject:
+
+    session_store/
+        manifest.json                                  segments, stats, dictionaries
+        month=2026-03/subject=rat_a/seg-000004/
+            sessions/{session,start,total_time,total_interactions,events}.npy
+            events/{session,entry,t,type,reward,between,time_between}.npy
+
+Each compaction run rewrites the partitions it adds to as one new segment
+(old rows plus new), then swaps the manifest atomically and only then
+deletes the replaced segments, so an interrupted run leaves the store as it
+was and partitions don't fill up with small files. The manifest keeps
+min/max of every column per segment. SessionStore.scan() uses those and the
+partition keys to skip whole segments without opening them, and memory-maps
+only the columns asked for.
+
+    python session_store.py compact
+    python session_store.py query events --columns t,type --from 2025-01 --to 2025-12 --subject rat_a
+
+The CSVs stay where they are; the log viewer still uses them.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+
+from log_archive import ARCHIVE_SUFFIX, open_log_text
+
+SESSION_COLUMNS = {
+    "session": np.int64,
+    "start": np.float64,  # Epoch seconds
+    "total_time": np.float64,
+    "total_interactions": np.int32,
+    "events": np.int32,
+}
+EVENT_COLUMNS = {
+    "session": np.int64,
+    "entry": np.int32,
+    "t": np.float64,  # Seconds from session start
+    "type": np.int16,  # Code into manifest["dictionaries"]["type"]
+    "reward": np.bool_,
+    "between": np.int32,
+    "time_between": np.float64,  # NaN where the log has none
+}
+TABLES = {"sessions": SESSION_COLUMNS, "events": EVENT_COLUMNS}
+UNKNOWN_SUBJECT = "unknown"
+LOG_NAME = re.compile(r"^log_(\d\d_\d\d_\d\d_\d\d_\d\d_\d\d)(?:__(.+?))?\.csv(?:\.gz)?$")
+
+
+def parse_log_name(filename):
+    """Returns (start epoch, subject) from log_<m_d_y_H_M_S>[__<subject>].csv, or None."""
+    match = LOG_NAME.match(filename)
+    if match is None:
+        return None
+    start = time.mktime(time.strptime(match.group(1), "%m_%d_%y_%H_%M_%S"))
+    return start, match.group(2) or UNKNOWN_SUBJECT
+
+
+def _number(value, kind=float, missing=np.nan):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return missing
+
+
+def read_session_log(path):
+    """Parses one session CSV (plain or archived) into its summary and detail rows."""
+    summary = {"total_time": np.nan, "total_interactions": 0}
+    events = []
+    with open_log_text(path) as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Header
+        for row in reader:
+            if len(row) < 10:
+                continue
+            if row[0]:  # Summary columns are only filled on the first row
+                summary["total_time"] = _number(row[1])
+                summary["total_interactions"] = _number(row[2], int, 0)
+            events.append((
+                _number(row[4], int, 0),
+                _number(row[5]),
+                row[6],
+                row[7] == "Yes",
+                _number(row[8], int, 0),
+                _number(row[9]),
+            ))
+    return summary, events
+
+
+class SessionStore:
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.manifest = self._load_manifest()
+        self.last_scan = None
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 1, "next_session": 1, "next_segment": 1, "sources": {}, "dictionaries": {"type": []}, "segments": []}
+
+    def _save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+
+    def _code(self, dictionary, value):
+        values = self.manifest["dictionaries"][dictionary]
+        if value not in values:
+            values.append(value)
+        return values.index(value)
+
+    def decode(self, dictionary, codes):
+        values = np.array(self.manifest["dictionaries"][dictionary], dtype=object)
+        return values[codes]
+
+    ## Writing ##
+    def _load_segment(self, segment, table):
+        directory = os.path.join(self.root, segment["path"], table)
+        return {name: np.load(os.path.join(directory, name + ".npy")) for name in TABLES[table]}
+
+    def add_sessions(self, logs):
+        """
+        Adds parsed sessions, merged into one segment per (month, subject).
+        `logs` is a list of (source name, start, subject, summary, events).
+        """
+        partitions = {}
+        removed = []
+        for source, start, subject, summary, events in logs:
+            month = time.strftime("%Y-%m", time.localtime(start))
+            partitions.setdefault((month, subject), []).append((source, start, summary, events))
+
+        for (month, subject), sessions in sorted(partitions.items()):
+            session_cols = {name: [] for name in SESSION_COLUMNS}
+            event_cols = {name: [] for name in EVENT_COLUMNS}
+            for source, start, summary, events in sessions:
+                session_id = self.manifest["next_session"]
+                self.manifest["next_session"] += 1
+                self.manifest["sources"][source] = session_id
+                for name, value in (("session", session_id), ("start", start), ("total_time", summary["total_time"]),
+                                    ("total_interactions", summary["total_interactions"]), ("events", len(events))):
+                    session_cols[name].append(value)
+                for entry, t, kind, reward, between, time_between in events:
+                    event_cols["session"].append(session_id)
+                    event_cols["entry"].append(entry)
+                    event_cols["t"].append(t)
+                    event_cols["type"].append(self._code("type", kind))
+                    event_cols["reward"].append(reward)
+                    event_cols["between"].append(between)
+                    event_cols["time_between"].append(time_between)
+
+            replaced = [seg for seg in self.manifest["segments"] if seg["month"] == month and seg["subject"] == subject]
+            segment = f"month={month}/subject={subject}/seg-{self.manifest['next_segment']:06d}"
+            self.manifest["next_segment"] += 1
+            stats = {}
+            rows = {}
+            for table, columns in (("sessions", session_cols), ("events", event_cols)):
+                directory = os.path.join(self.root, segment, table)
+                os.makedirs(directory, exist_ok=True)
+                stats[table] = {}
+                old = [self._load_segment(seg, table) for seg in replaced]
+                for name, values in columns.items():
+                    array = np.concatenate([part[name] for part in old] + [np.asarray(values, dtype=TABLES[table][name])])
+                    rows[table] = len(array)
+                    np.save(os.path.join(directory, name + ".npy"), array)
+                    finite = array[~np.isnan(array)] if array.dtype.kind == "f" else array
+                    if len(finite):
+                        stats[table][name] = [finite.min().item(), finite.max().item()]
+            self.manifest["segments"] = [seg for seg in self.manifest["segments"] if seg not in replaced]
+            self.manifest["segments"].append({"path": segment, "month": month, "subject": subject, "rows": rows, "stats": stats})
+            removed.extend(seg["path"] for seg in replaced)
+        self._save_manifest()
+        for path in removed:
+            shutil.rmtree(os.path.join(self.root, path), ignore_errors=True)
+
+    ## Reading ##
+    def segments(self, months=None, subjects=None, ranges=None, table="events"):
+        """Segments that can contain matching rows, judged from the manifest alone."""
+        ranges = ranges or {}
+        for segment in self.manifest["segments"]:
+            if months is not None:
+                first, last = months
+                if (first and segment["month"] < first) or (last and segment["month"] > last):
+                    continue
+            if subjects is not None and segment["subject"] not in subjects:
+                continue
+            stats = segment["stats"].get(table, {})
+            if any(column in stats and (stats[column][1] < lo or stats[column][0] > hi) for column, (lo, hi) in ranges.items()):
+                continue
+            if segment["rows"][table] == 0:
+                continue
+            yield segment
+
+    def scan(self, table="events", columns=None, months=None, subjects=None, ranges=None):
+        """
+        Reads `columns` of `table` from the matching segments.
+        months: (first, last) as "YYYY-MM", either may be None
+        subjects: iterable of subject names
+        ranges: {column: (low, high)}, inclusive
+        Returns {column: numpy array}; self.last_scan says how much was read.
+        """
+        schema = TABLES[table]
+        columns = list(columns or schema)
+        ranges = ranges or {}
+        subjects = set(subjects) if subjects is not None else None
+        needed = list(dict.fromkeys(columns + list(ranges)))
+        parts = {name: [] for name in columns}
+        read = 0
+        bytes_read = 0
+        for segment in self.segments(months, subjects, ranges, table):
+            read += 1
+            directory = os.path.join(self.root, segment["path"], table)
+            arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in needed}
+            mask = None
+            for column, (lo, hi) in ranges.items():
+                keep = (arrays[column] >= lo) & (arrays[column] <= hi)
+                mask = keep if mask is None else mask & keep
+            for name in columns:
+                values = arrays[name] if mask is None else arrays[name][mask]
+                parts[name].append(np.asarray(values))
+            bytes_read += sum(array.nbytes for array in arrays.values())
+        self.last_scan = {
+            "segments_total": len(self.manifest["segments"]),
+            "segments_read": read,
+            "bytes_read": bytes_read,
+        }
+        return {name: np.concatenate(values) if values else np.empty(0, dtype=schema[name]) for name, values in parts.items()}
+
+
+def compact_sessions(log_dir, store_root, min_age_s=3600, skip=()):
+    """
+    Adds every finished session log not yet in the store. Logs modified in
+    the last `min_age_s` seconds (possibly still being written) wait for the
+    next run. Returns the number of sessions added.
+    """
+    store = SessionStore(store_root)
+    skip = {os.path.abspath(path) for path in skip if path}
+    cutoff = time.time() - min_age_s
+    logs = []
+    for filename in sorted(os.listdir(log_dir)):
+        source = filename[:-len(ARCHIVE_SUFFIX)] if filename.endswith(ARCHIVE_SUFFIX) else filename
+        path = os.path.join(log_dir, filename)
+        parsed = parse_log_name(filename)
+        if parsed is None or source in store.manifest["sources"] or os.path.abspath(path) in skip:
+            continue
+        if os.path.getmtime(path) > cutoff:
+            continue
+        try:
+            summary, events = read_session_log(path)
+        except (OSError, csv.Error, EOFError) as e:
+            print(f"Skipping unreadable log {filename}: {e}")
+            continue
+        start, subject = parsed
+        logs.append((source, start, subject, summary, events))
+    if logs:
+        store.add_sessions(logs)
+    return len(logs)
+
+
+def main():
+    here = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Columnar store of finished sessions")
+    parser.add_argument("--store", default=os.path.join(here, "session_store"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser("compact", help="Add finished session logs to the store")
+    compact.add_argument("--logs", default=os.path.join(here, "logs"))
+    compact.add_argument("--min-age", type=float, default=3600, help="Skip logs modified in the last N seconds")
+    query = commands.add_parser("query", help="Read columns from the store")
+    query.add_argument("table", choices=sorted(TABLES))
+    query.add_argument("--columns", help="Comma separated, default all")
+    query.add_argument("--from", dest="first", help="First month, YYYY-MM")
+    query.add_argument("--to", dest="last", help="Last month, YYYY-MM")
+    query.add_argument("--subject", action="append", help="May be given more than once")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        print(f"Added {compact_sessions(args.logs, args.store, args.min_age)} sessions to {args.store}")
+        return
+    store = SessionStore(args.store)
+    columns = args.columns.split(",") if args.columns else None
+    result = store.scan(args.table, columns, (args.first, args.last), args.subject)
+    for name, values in result.items():
+        if name == "type":
+            values = store.decode("type", values)
+        print(f"{name}: {len(values)} values, first {list(values[:5])}")
+    print(store.last_scan)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,44 @@
+from lazy_init import StartupProfile, LazyResource
+startup = StartupProfile()
+
 from signal import pause
-from openpyxl import Workbook
 from flask import Flask, Response, render_template, request, jsonify,  send_file, send_from_directory, url_for, redirect
 from gpiozero import LED, Button, OutputDevice
+from gpio_adapter import ConditionedButton, InputPolicy
 import json
 import time
 import threading
-import psycopg2
-from rpi_ws281x import Adafruit_NeoPixel, Color
 import csv
 import os
+from event_ring import EventRing, drain_rings, LEVER_PRESS, NOSE_POKE, STIMULUS_ONSET
+from http_cache import conditional, file_etag, is_fresh, not_modified, with_etag
+from trial_clock import SystemClock
+from trial_checkpoint import CheckpointWriter, load_checkpoint, discard_checkpoint
+from trial_protocol import ProtocolError, compile_protocol
+from db_outbox import Outbox
+from timing_watchdog import TimingWatchdog
+from log_archive import BlockReader, archive_logs, display_name, open_log_text, resolve_log
+from session_store import compact_sessions
+import profiling
 from werkzeug.utils import secure_filename, safe_join
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS # To handle backend and frontend running on different ports
+startup.mark("imports")
 
 app = Flask(__name__)
 CORS(app) # Allow all domains by default
+if profiling.enabled():
+    profiling.register_profiling(app) # Route timing and /admin/profile endpoints (SB_PROFILING=1)
 settings_path = 'config.json'
 log_directory = os.path.join(os.path.dirname(__file__), 'logs')
+trial_checkpoint_path = os.path.join(os.path.dirname(__file__), 'current_trial.ckpt') # Kept out of logs/ so the log viewer never lists it
+session_store_directory = os.path.join(os.path.dirname(__file__), 'session_store')
+CHECKPOINT_INTERVAL = 1.0 # Seconds between periodic checkpoints of a running trial
 temp_directory = os.path.join(os.path.dirname(__file__), 'temp')
+outbox_path = os.path.join(os.path.dirname(__file__), 'outbox.db')
 
 #region Databse
 def get_db_connection():
+    import psycopg2 # Only loaded when the remote database is actually used
     conn = psycopg2.connect(
         host=os.getenv('DATABASE_HOST'),
         database=os.getenv('DATABASE'),
@@ -29,25 +47,72 @@ def get_db_connection():
     )
     return conn
 
-@app.route('/push_data', methods=['POST'])
-def push_data():
-    data = request.json
+# Remote inserts by outbox kind
+OUTBOX_INSERTS = {
+    "your_table": "INSERT INTO your_table (column1, column2) VALUES %s",
+}
+OUTBOX_COLUMNS = {
+    "your_table": ("column1", "column2"),
+}
+
+def deliver_rows(kind, payloads):
+    # One connection and one bulk insert per batch; raising keeps the rows in the outbox
+    from psycopg2.extras import execute_values
+    columns = OUTBOX_COLUMNS[kind]
     conn = get_db_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("""
-            INSERT INTO your_table (column1, column2)
-            VALUES (%s, %s)
-        """, (data['column1'], data['column2']))
+        with conn.cursor() as cur:
+            execute_values(cur, OUTBOX_INSERTS[kind], [tuple(p[c] for c in columns) for p in payloads])
         conn.commit()
-        return jsonify({"status": "success"}), 200
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        return jsonify({"status": "error", "message": str(e)}), 500
+        raise
     finally:
-        cur.close()
         conn.close()
 
+def classify_db_error(e):
+    # Connection problems are retried for as long as it takes. So are schema
+    # and permission errors (ProgrammingError): they refuse every row until
+    # someone fixes the database, and must not empty the outbox into the
+    # failed table. Only rows the database refuses for their own content are
+    # set aside so they don't block the rest.
+    try:
+        import psycopg2
+    except ImportError:
+        return "transient" # Can't tell anything about the rows without the driver
+    if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.ProgrammingError, psycopg2.NotSupportedError)):
+        return "transient"
+    if isinstance(e, (psycopg2.DataError, psycopg2.IntegrityError)):
+        return "permanent"
+    return None
+
+# Rows for the remote database are stored locally first and delivered in the
+# background, so push_data works while the remote database is unreachable
+outbox = LazyResource("db outbox", lambda: Outbox(outbox_path, deliver_rows, classify=classify_db_error).start(), startup)
+
+@app.route('/push_data', methods=['POST'])
+def push_data():
+    data = request.json
+    try:
+        row = {column: data[column] for column in OUTBOX_COLUMNS["your_table"]}
+    except (KeyError, TypeError):
+        return jsonify({"status": "error", "message": "Expected column1 and column2"}), 400
+    if not outbox.get().put("your_table", row):
+        return jsonify({"status": "error", "message": "Outbox full, remote database unreachable for too long"}), 503
+    return jsonify({"status": "success", "queued": True}), 200
+
+@app.route('/push_data/status', methods=['GET'])
+def push_data_status(): # Rows waiting for the remote database and delivery errors
+    return jsonify(outbox.get().stats())
+
+@app.route('/push_data/failed/retry', methods=['POST'])
+def retry_failed_rows(): # Put rows the database refused back in the outbox, e.g. after fixing the table
+    return jsonify({"status": "success", "requeued": outbox.get().requeue_failed()}), 200
+
+@app.route('/push_data/failed', methods=['DELETE'])
+def purge_failed_rows(): # Delete rows the database refused, once they are no longer needed
+    return jsonify({"status": "success", "deleted": outbox.get().purge_failed()}), 200
+
 @app.route('/pull_data/<table>/<condition>', methods=['GET'])
 def pull_data(table, condition):
     conn = get_db_connection()
@@ -75,14 +140,24 @@ LED_FREQ_HZ    = 800000  # LED signal frequency in hertz (usually 800khz)
 LED_DMA        = 10      # DMA channel to use for generating signal (try 10)
 LED_BRIGHTNESS = 255     # Set to 0 for darkest and 255 for brightest
 LED_INVERT     = False   # True to invert the signal (when using NPN transistor level shift)
-# Create NeoPixel object with appropriate configuration.
-strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS)
-try:
-    strip.begin()
-    print("Starting strip")
-except:
-    print("Error starting strip")
-    pass
+def Color(red, green, blue, white=0):
+    """Packs a color the same way rpi_ws281x.Color does, without importing the driver."""
+    return (white << 24) | (red << 16) | (green << 8) | blue
+
+def create_strip():
+    # Create NeoPixel object with appropriate configuration.
+    try:
+        from rpi_ws281x import Adafruit_NeoPixel
+        strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS)
+        strip.begin()
+        print("Starting strip")
+        return strip
+    except:
+        print("Error starting strip")
+        return None
+
+# The strip is started on first use (or by warm_up_hardware after the server is up)
+strip = LazyResource("led strip", create_strip, startup)
 #endregion
 
 #region I/O
@@ -102,8 +177,10 @@ except:
 #speaker_port = 13##
 
 #Button Settup
-lever = Button(lever_port, bounce_time=0.1)
-poke = Button(nose_poke_port, pull_up=False, bounce_time=0.1)
+# Bounces are filtered in software (gpio_adapter.InputConditioner) so they never reach the trial.
+# gpiozero's Button, like the feeder and LEDs in this file, so the inputs are real whatever GPIO_MODE says
+lever = LazyResource("lever", lambda: ConditionedButton(lever_port, InputPolicy(debounce_s=0.1), button_class=Button), startup)
+poke = LazyResource("nose poke", lambda: ConditionedButton(nose_poke_port, InputPolicy(debounce_s=0.1), button_class=Button, pull_up=False), startup)
 #water_primer = Button(water_primer_port, bounce_time=0.1)
 #manual_stimulus_button = Button(manual_stimulus_port, bounce_time=0.1)
 #manual_interaction = Button(manual_interaction_port, bounce_time=0.1)
@@ -117,21 +194,21 @@ poke = Button(nose_poke_port, pull_up=False, bounce_time=0.1)
 
 #region Action Functions
 #Rewards
-def feed():
+def feed(sleep=time.sleep):
 	try:
 		feeder_motor = OutputDevice(feeder_port, active_high=False, initial_value=False)
 		feeder_motor.on()
-		time.sleep(1) #TODO Adjust Feed Time
+		sleep(1) #TODO Adjust Feed Time
 		feeder_motor.off()
 		feeder_motor.close()
 	finally:
 		return
 
-def water():
+def water(sleep=time.sleep):
     try:
         water_motor = OutputDevice(water_port, active_high=False, initial_value=False)
         water_motor.on()
-        time.sleep(.15) #TODO Adjust Water Time
+        sleep(.15) #TODO Adjust Water Time
         water_motor.off()
         water_motor.close()
     finally:
@@ -164,16 +241,54 @@ def flashLightStim(strip, color, wait_ms=10):
             strip.show()
             time.sleep(wait_ms/1000.0)
 
-def play_sound(pin, duration): #TODO
+def create_audio():
+    # Loads NumPy and opens the audio device (AUDIO_SINK=alsa on the Pi)
+    from audio_engine import AudioEngine
+    return AudioEngine()
+
+audio = LazyResource("audio", create_audio, startup)
+
+def play_sound(pin, duration, frequency=2000, amplitude=0.5):
+	# Non-blocking: the tone is queued to the audio output thread
 	print("Playing sound")
-	#buzzer.on
-	time.sleep(duration) # Wait a predetermained amount of time
-	#buzzer.off
+	audio.get().play("tone", frequency, duration, amplitude)
+
+class HardwareIO:
+    """
+    The box's outputs and inputs as used by TrialStateMachine. A simulated
+    stand-in with the same methods (see trial_sim.py) lets whole sessions run
+    without hardware.
+    """
+    def feed(self, sleep=time.sleep):
+        feed(sleep)
+
+    def water(self, sleep=time.sleep):
+        water(sleep)
+
+    def flash(self, color):
+        # Returns False when there is no strip to flash
+        led_strip = strip.get()
+        if not led_strip:
+            return False
+        flashLightStim(led_strip, color)
+        return True
+
+    def prepare_tone(self, params):
+        audio.get().prepare(*params)
+
+    def tone(self, params, on_onset):
+        audio.get().play(*params, on_onset=on_onset)
+
+    def bind_input(self, interaction_type, callback):
+        if interaction_type == 'lever':
+            lever.get().when_pressed = callback
+        elif interaction_type == 'poke':
+            poke.get().when_pressed = callback
 
 #Interactions
 def lever_press():
     try:
-        trial_state_machine.lever_press()
+        trial_state_machine.inject(LEVER_PRESS)
     except:
         pass
     feed()
@@ -181,7 +296,7 @@ def lever_press():
 def nose_poke():
     print("Nose poke")
     try:
-        trial_state_machine.nose_poke()
+        trial_state_machine.inject(NOSE_POKE)
     except:
         pass
     water()
@@ -199,6 +314,14 @@ def save_settings(settings):
 	with open(settings_path, 'w') as file:
 		json.dump(settings, file, indent=4)
 
+def settings_etag():
+    # The settings revision is the config file's mtime and size, so edits made
+    # through the form or by hand both invalidate cached pages
+    try:
+        return "settings-" + file_etag(settings_path)
+    except FileNotFoundError:
+        return "settings-none"
+
 def rename_log_files(_log_directory=log_directory):
     # Iterate over all files in the directory
     for filename in os.listdir(_log_directory):
@@ -220,7 +343,63 @@ if not os.path.exists(log_directory):
     os.makedirs(log_directory)
 
 def list_log_files(_log_directory=log_directory):
-    return [f for f in os.listdir(_log_directory) if os.path.isfile(os.path.join(_log_directory, f))]
+    # Archived logs (name.csv.gz) are listed under their original name; only session CSVs are listed
+    names = {display_name(f) for f in os.listdir(_log_directory) if os.path.isfile(os.path.join(_log_directory, f))}
+    return sorted(name for name in names if name.endswith('.csv'))
+
+LOG_ARCHIVE_DAYS = float(os.getenv('LOG_ARCHIVE_DAYS', '7')) # Compress logs older than this; 0 turns archiving off
+
+def archive_old_logs():
+    # Runs once a day in the background (see __main__). Finished sessions go
+    # into the columnar store first, so it never has to wait for an archive.
+    while True:
+        # Looked up on every pass: /start replaces the global machine
+        current_log = trial_state_machine.log_path
+        try:
+            added = compact_sessions(log_directory, session_store_directory, skip=[current_log])
+            if added:
+                print(f"Added {added} sessions to the session store")
+        except Exception as e:
+            print(f"Session compaction failed: {e}")
+        try:
+            if LOG_ARCHIVE_DAYS > 0:
+                archived = archive_logs(log_directory, LOG_ARCHIVE_DAYS, skip=[current_log])
+                if archived:
+                    print(f"Archived {len(archived)} old logs")
+        except Exception as e:
+            print(f"Log archiving failed: {e}")
+        time.sleep(24 * 3600)
+
+def recover_interrupted_trial(machine):
+    # Called at startup. If the last session never finished (container restart,
+    # power loss), resume it when the gap was short, otherwise write out what
+    # was recorded. TRIAL_RECOVERY=resume|finalize|auto picks the behaviour.
+    session = load_checkpoint(trial_checkpoint_path)
+    if session is None:
+        return None
+    gap = time.time() - (session.get('wall') or 0)
+    mode = os.getenv('TRIAL_RECOVERY', 'auto')
+    max_gap = float(os.getenv('TRIAL_RESUME_MAX_GAP', 300))
+    if mode == 'resume' or (mode == 'auto' and gap <= max_gap):
+        print(f"Resuming interrupted trial after {gap:.0f}s")
+        try:
+            machine.resume_from_checkpoint(session)
+            return 'resumed'
+        except ProtocolError as e:
+            print(f"Cannot resume, the saved settings are invalid: {e}")
+    print(f"Finalizing interrupted trial ({gap:.0f}s since last checkpoint)")
+    machine.finalize_from_checkpoint(session)
+    discard_checkpoint(trial_checkpoint_path)
+    return 'finalized'
+
+def warm_up_hardware():
+    # Runs in the background once the server is starting so the first trial
+    # doesn't pay for driver setup
+    for resource in (strip, lever, poke):
+        try:
+            resource.get()
+        except Exception as e:
+            print(f"Error initializing {resource.name}: {e}")
 #endregion
 
 #region App Routes
@@ -228,6 +407,18 @@ def list_log_files(_log_directory=log_directory):
 def homepage():
 	return render_template('homepage.html')
 
+@app.route('/startup-profile')
+def startup_profile(): # How long each startup phase and lazy init took
+    return jsonify(startup.as_dict())
+
+@app.route('/trial-timing')
+def trial_timing(): # Scheduling lag and overruns of the trial loop and stimulus timers
+    return jsonify(trial_state_machine.watchdog.stats())
+
+@app.route('/audio-stats')
+def audio_stats(): # Playback count and onset latency of the audio engine
+    return jsonify(audio.get().stats() if audio.ready else {})
+
 @app.route('/testingpage')
 def io_testing():
     return render_template('testingpage.html')
@@ -244,7 +435,7 @@ def test_io():
         elif action == 'water':
             water()
         elif action == 'light':
-            flashLightStim(strip, Color(255, 255, 255))  # Example color
+            flashLightStim(strip.get(), Color(255, 255, 255))  # Example color
         elif action == 'sound':
             play_sound(speaker_port, 1)
         elif action == 'lever_press':
@@ -277,15 +468,18 @@ def start():
 
     global trial_state_machine
     settings = load_settings()  # Load settings
-    if trial_state_machine.state == 'Running':
-        return render_template('runningtrialpage.html', settings=settings)
-    elif trial_state_machine.state == 'Idle':
-        if trial_state_machine.start_trial():
-            return render_template('runningtrialpage.html', settings=settings)
-    elif trial_state_machine.state == 'Completed':
-        trial_state_machine = TrialStateMachine()
-        if trial_state_machine.start_trial():
+    try:
+        if trial_state_machine.state == 'Running':
             return render_template('runningtrialpage.html', settings=settings)
+        elif trial_state_machine.state == 'Idle':
+            if trial_state_machine.start_trial(subject=test_name):
+                return render_template('runningtrialpage.html', settings=settings)
+        elif trial_state_machine.state == 'Completed':
+            trial_state_machine = TrialStateMachine(checkpoint_path=trial_checkpoint_path)
+            if trial_state_machine.start_trial(subject=test_name):
+                return render_template('runningtrialpage.html', settings=settings)
+    except ProtocolError as e: # Nothing was started
+        return jsonify({"status": "error", "message": f"Invalid trial settings: {e}", "problems": e.problems}), 400
     return render_template('trialpage.html', settings=settings)
 
 @app.route('/stop', methods=['POST'])
@@ -296,8 +490,7 @@ def stop(): # Stops the trial
 
 @app.route('/trial-settings', methods=['GET'])
 def trial_settings(): # Displays the trial settings with the settings loaded from the file
-    settings = load_settings()
-    return render_template('trialpage.html', settings=settings)
+    return conditional(settings_etag(), lambda: render_template('trialpage.html', settings=load_settings()))
 
 @app.route('/update-trial-settings', methods=['POST'])
 def update_trial_settings(): # Updates the trial settings with the form data
@@ -329,42 +522,82 @@ def log_viewer(): # Displays the log files in the log directory
 def download_raw_log_file(filename): # Download the raw log file
     filename = secure_filename(filename)  # Sanitize the filename
     try:
-        return send_from_directory(directory=log_directory, path=filename, as_attachment=True, download_name=filename)
+        path, archived = resolve_log(log_directory, filename)
+        if path is None:
+            return "Log file not found.", 404
+        etag = file_etag(path)
+        if is_fresh(etag):
+            return not_modified(etag)
+        if not archived:
+            response = send_from_directory(directory=log_directory, path=filename, as_attachment=True, download_name=filename, etag=False)
+            return with_etag(response, etag)
+        return with_etag(stream_archived_log(path, display_name(filename)), etag)
     except FileNotFoundError:
         return "Log file not found.", 404
+
+def stream_archived_log(path, download_name):
+    # Decompresses block by block while sending; a Range request only touches the blocks it covers
+    reader = BlockReader(path)
+    headers = {'Content-Disposition': f'attachment; filename="{download_name}"'}
+    byte_range = request.range if reader.size is not None else None
+    if byte_range is not None and len(byte_range.ranges) == 1:
+        start, stop = byte_range.range_for_length(reader.size) or (None, None)
+        if start is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{reader.size}'})
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{reader.size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(reader.iter_chunks(start, stop), status=206, mimetype='text/csv', headers=headers)
+    if reader.size is not None:
+        headers['Content-Length'] = str(reader.size)
+        headers['Accept-Ranges'] = 'bytes'
+    return Response(reader.iter_chunks(), mimetype='text/csv', headers=headers)
     
 @app.route('/download-excel-log/<filename>')
 def download_excel_log_file(filename): # Download the Excel log file
     # Use safe_join to ensure the filename is secure
+    filename = display_name(filename)
     secure_filename = safe_join(log_directory, filename)
+    temp_filename = f'{filename.rsplit(".", 1)[0]}.xlsx'
     try:
-        # Initialize a workbook and select the active worksheet
-        wb = Workbook()
-        ws = wb.active
-        if not os.path.exists(temp_directory):
-            os.makedirs(temp_directory)
-        
-        # Define your column titles here
-        column_titles = ['Date/Time', 'Total Time', 'Total Interactions', '', 'Entry', 'Interaction Time', 'Type', 'Reward', 'Interactions Between', 'Time Between']
-        ws.append(column_titles)
+        if secure_filename:
+            secure_filename, _ = resolve_log(log_directory, filename) # May be the compressed archive
         # Check if the file exists and is a CSV file
-        if not os.path.isfile(secure_filename) or not filename.endswith('.csv'):
+        if not secure_filename or not os.path.isfile(secure_filename) or not filename.endswith('.csv'):
             print(f'CSV file not found or incorrect file type: {secure_filename}')
             return "Log file not found.", 404
-        # Read the CSV file and append rows to the worksheet
-        with open(secure_filename, mode='r', newline='') as file:
-            reader = csv.reader(file)
-            next(reader, None)  # Skip the header of the CSV if it's already included
-            for row in reader:
-                ws.append(row)
-        
-        # Save the workbook to a temporary file
-        temp_filename = f'{filename.rsplit(".", 1)[0]}.xlsx'
+
+        # The spreadsheet is derived from the CSV, so the CSV's version tags it
+        etag = "xlsx-" + file_etag(secure_filename)
+        if is_fresh(etag):
+            return not_modified(etag)
+
+        if not os.path.exists(temp_directory):
+            os.makedirs(temp_directory)
         temp_filepath = os.path.join(temp_directory, temp_filename)
-        wb.save(temp_filepath)
+
+        # Only convert again if the CSV changed since the last conversion
+        if not os.path.isfile(temp_filepath) or os.path.getmtime(temp_filepath) < os.path.getmtime(secure_filename):
+            # Initialize a workbook and select the active worksheet
+            from openpyxl import Workbook # Only loaded when a spreadsheet is requested
+            wb = Workbook()
+            ws = wb.active
+
+            # Define your column titles here
+            column_titles = ['Date/Time', 'Total Time', 'Total Interactions', '', 'Entry', 'Interaction Time', 'Type', 'Reward', 'Interactions Between', 'Time Between']
+            ws.append(column_titles)
+            # Read the CSV file and append rows to the worksheet
+            with open_log_text(secure_filename) as file:
+                reader = csv.reader(file)
+                next(reader, None)  # Skip the header of the CSV if it's already included
+                for row in reader:
+                    ws.append(row)
+
+            # Save the workbook to a temporary file
+            wb.save(temp_filepath)
         
         # Send the Excel file as an attachment
-        return send_file(temp_filepath, as_attachment=True, download_name=temp_filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response = send_file(temp_filepath, as_attachment=True, download_name=temp_filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', etag=False)
+        return with_etag(response, etag)
     except FileNotFoundError:
         print(f'Excel file not found: {temp_filename}')
         return "Converted log file not found.", 404
@@ -375,20 +608,21 @@ def download_excel_log_file(filename): # Download the Excel log file
 @app.route('/view-log/<filename>')
 def view_log(filename): # View the log file in the browser
     filename = secure_filename(filename)
-    file_path = os.path.join(log_directory, filename)
-
-    if os.path.isfile(file_path):
-        with open(file_path, 'r') as file:
-            log_content = file.readlines()
-
-        # Create an HTML table with the log content
-        rows = []
-        for line in log_content:
-            cells = line.strip().split(',')
-            rows.append(cells)
-            
-        # Pass the rows to the template instead of directly returning HTML
-        return render_template("t_logviewer.html", rows=rows)
+    file_path, _ = resolve_log(log_directory, filename)
+
+    if file_path is not None:
+        def render_log():
+            # Create an HTML table with the log content (archived logs are decompressed as they are read)
+            rows = []
+            with open_log_text(file_path) as file:
+                for line in file:
+                    cells = line.strip().split(',')
+                    rows.append(cells)
+
+            # Pass the rows to the template instead of directly returning HTML
+            return render_template("t_logviewer.html", rows=rows)
+        # The file is only read and rendered if the browser's copy is out of date
+        return conditional("view-" + file_etag(file_path), render_log)
     else:
         return "Log file not found.", 404
 #endregion
@@ -401,32 +635,48 @@ class TrialStateMachine:
         lock (threading.Lock): A lock to ensure thread safety.
         currentIteration (int): The current iteration of the trial.
         settings (dict): The settings loaded from a configuration file.
+        plan (TrialPlan): The settings compiled by trial_protocol.compile_protocol at start.
         startTime (float): The start time of the trial.
         interactable (bool): Whether the system is currently interactable.
         lastSuccessfulInteractTime (float): The time of the last successful interaction.
         lastStimulusTime (float): The time of the last stimulus.
-        stimulusCooldownThread (threading.Timer): The thread handling stimulus cooldown.
+        stimulusCooldownThread: The pending cooldown timer from clock.timer().
         log_path (str): The path to the log file.
         interactions_between (int): The number of interactions between successful interactions.
         time_between (float): The time between successful interactions.
         total_interactions (int): The total number of interactions.
         total_time (float): The total time of the trial.
         interactions (list): A list of interactions during the trial.
+        events (EventRing): Presses stamped by the GPIO callbacks, applied by the trial thread.
+        manual_events (EventRing): Presses injected from request handlers, guarded by manual_lock.
+        clock: Source of time, sleeps and timers (trial_clock.SystemClock or SimulatedClock).
+        io: The outputs and inputs the trial drives (HardwareIO by default).
+        checkpoint (CheckpointWriter): Saves trial state for crash recovery, None if disabled.
+        watchdog (TimingWatchdog): Lag and overruns of the trial loop and stimulus timers.
     Methods:
         load_settings(): Loads settings from a configuration file.
-        start_trial(): Starts the trial.
+        start_trial(settings=None, background=True, subject=None): Starts the trial. Raises ProtocolError for invalid settings.
+        use_plan(plan): Binds the stimulus, reward and input handlers the plan calls for.
         pause_trial(): Pauses the trial.
         resume_trial(): Resumes the trial.
         stop_trial(): Stops the trial.
-        run_trial(goal, duration): Runs the trial logic.
-        lever_press(): Handles a lever press interaction.
-        nose_poke(): Handles a nose poke interaction.
+        run_trial(goal, duration, resumed=False): Runs the trial logic.
+        checkpoint_state(): The trial state saved in checkpoints.
+        save_checkpoint(): Appends changed state to the checkpoint file.
+        resume_from_checkpoint(session, background=True): Continues an interrupted trial.
+        finalize_from_checkpoint(session): Writes the log of an interrupted trial without resuming.
+        lever_press(): GPIO callback, queues a lever press event.
+        nose_poke(): GPIO callback, queues a nose poke event.
+        inject(code): Queues an event from a non-GPIO thread.
+        process_events(): Applies queued events on the trial thread.
+        handle_interaction(interaction_type, current_time): Applies one interaction.
         queue_stimulus(): Queues a stimulus after a cooldown period.
+        timed_stimulus(stimulus): Starts the cooldown timer for a stimulus, timed by the watchdog.
         give_stimulus(): Gives a stimulus immediately.
         light_stimulus(): Handles the light stimulus.
-        noise_stimulus(): Handles the noise stimulus.
+        noise_stimulus(): Plays the tone stimulus without blocking.
         give_reward(): Gives a reward based on the settings.
-        add_interaction(interaction_type, reward_given, interactions_between=0, time_between=''): Logs an interaction.
+        add_interaction(interaction_type, reward_given, interactions_between=0, time_between='', timestamp=None): Logs an interaction.
         push_log(): Writes the log to a file.
         finish_trial(): Finishes the trial and logs the results.
         error(): Handles errors and sets the state to 'Error'.
@@ -434,11 +684,19 @@ class TrialStateMachine:
         resume_trial_logic(): Logic to resume the trial.
         handle_error(): Logic to handle errors.
     """
-    def __init__(self):
+    def __init__(self, clock=None, io=None, log_dir=None, checkpoint_path=None):
+        self.clock = clock if clock is not None else SystemClock()
+        self.io = io if io is not None else HardwareIO()
+        self.log_dir = log_dir if log_dir is not None else log_directory
         self.state = 'Idle'
         self.lock = threading.Lock()
         self.currentIteration = 0
         self.settings = {}
+        self.plan = None
+        self._stimulus = None # Handlers resolved from the plan by use_plan()
+        self._reward = None
+        self._light_color = None
+        self._input = None
         self.startTime = None
         self.interactable = True
         self.lastSuccessfulInteractTime = None
@@ -450,6 +708,16 @@ class TrialStateMachine:
         self.total_interactions = 0
         self.total_time = 0
         self.interactions = []
+        self.event_wakeup = threading.Event()
+        self.events = EventRing(1024, wakeup=self.event_wakeup, clock=self.clock.time)
+        self.manual_events = EventRing(64, wakeup=self.event_wakeup, clock=self.clock.time)
+        self.manual_lock = threading.Lock()
+        self._event_batch = []
+        self.checkpoint = CheckpointWriter(checkpoint_path) if checkpoint_path else None
+        self._next_checkpoint = 0.0
+        self.watchdog = TimingWatchdog(self.clock)
+        self._looping = False # run_trial's loop is running (checked by stop_trial under self.lock)
+        self._blocked = 0.0 # Time the current loop pass spent in intentional waits (reward motors, light flash)
     def load_settings(self):
         # Implementation of loading settings from file
         try:
@@ -458,25 +726,50 @@ class TrialStateMachine:
         except FileNotFoundError:
             self.settings = {}
             
-    def start_trial(self):
+    def start_trial(self, settings=None, background=True, subject=None):
+        # settings: use these instead of config.json
+        # background: False runs the whole trial on the calling thread (used with a SimulatedClock)
+        # subject: the test name, kept in the log name so the session store can partition by it
         with self.lock:
-            if self.state == 'Idle':
+            if self.state != 'Idle':
+                return False
+            if settings is None:
                 self.load_settings()
-                goal = int(self.settings.get('goal', 0))
-                duration = int(self.settings.get('duration', 0)) * 60
-                self.timeRemaining = duration
-                self.currentIteration = 0
-                self.lastStimulusTime = time.time()
-                self.state = 'Running'
-                # Format the current time to include date and time in the filename
-                # YYYY_MM_DD_HH_MM_SS
-                safe_time_str = time.strftime("%m_%d_%y_%H_%M_%S").replace(":", "_")
-                # Update log_path to include the date and time
-                self.log_path = f"/home/jacob/Downloads/skinner_box-main/logs/log_{safe_time_str}.csv"
-                threading.Thread(target=self.run_trial, args=(goal, duration)).start()
-                self.give_stimulus()
-                return True
-            return False
+            else:
+                self.settings = dict(settings)
+            self.use_plan(compile_protocol(self.settings)) # Invalid settings fail here, before anything starts
+            goal = self.plan.goal
+            duration = self.plan.duration_s
+            self.timeRemaining = duration
+            self.currentIteration = 0
+            self.lastStimulusTime = self.clock.time()
+            self.state = 'Running'
+            # Format the current time to include date and time in the filename
+            # YYYY_MM_DD_HH_MM_SS
+            safe_time_str = time.strftime("%m_%d_%y_%H_%M_%S").replace(":", "_")
+            # Update log_path to include the date and time
+            name = f"log_{safe_time_str}"
+            if subject and secure_filename(subject):
+                name += f"__{secure_filename(subject)}"
+            self.log_path = os.path.join(self.log_dir, f"{name}.csv")
+            if self.plan.tone is not None:
+                self.io.prepare_tone(self.plan.tone) # Synthesize before the animal hears it
+        if background:
+            threading.Thread(target=self.run_trial, args=(goal, duration), name="trial").start()
+            self.give_stimulus()
+        else:
+            self.give_stimulus()
+            self.run_trial(goal, duration)
+        return True
+
+    def use_plan(self, plan):
+        # Everything the protocol decides is resolved here once, so events,
+        # timers and the trial loop make direct calls without looking at settings
+        self.plan = plan
+        self._stimulus = self.light_stimulus if plan.stimulus == 'light' else self.noise_stimulus
+        self._reward = self.io.water if plan.reward == 'water' else self.io.feed
+        self._light_color = Color(*plan.rgb) if plan.rgb is not None else None
+        self._input = (plan.interaction, self.lever_press if plan.interaction == 'lever' else self.nose_poke)
 
     def pause_trial(self):
         with self.lock:
@@ -497,36 +790,95 @@ class TrialStateMachine:
     def stop_trial(self):
         with self.lock:
             if self.state in ['Preparing', 'Running', 'Paused']:
+                if self.state == 'Paused' and not self._looping and self.checkpoint is not None:
+                    self.checkpoint.finish() # The loop already left and kept the checkpoint for the pause
                 self.state = 'Idle'
                 return True
             return False
 
-    def run_trial(self, goal, duration):
-        self.startTime = time.time()
+    def run_trial(self, goal, duration, resumed=False):
+        if not resumed:
+            self.startTime = self.clock.time()
+        if self.checkpoint is not None:
+            self.checkpoint.start(self.settings, self.log_path, self.checkpoint_state(), self.interactions)
+            self._next_checkpoint = self.clock.time() + CHECKPOINT_INTERVAL
+
+        self.io.bind_input(*self._input)
+        cooldown = self.plan.cooldown_s
+        self._looping = True
 
-        if(self.settings.get('interactionType') == 'lever'):
-            lever.when_pressed = self.lever_press
-        elif(self.settings.get('interactionType') == 'poke'):
-            poke.when_pressed = self.nose_poke
+        self.watchdog.tune()
+        if isinstance(self.clock, SystemClock):
+            self.watchdog.watch() # Stall detection only makes sense in real time
 
         while self.state == 'Running':
-            self.timeRemaining = (duration - (time.time() - self.startTime)).__round__(2)
-            if (time.time() - self.lastStimulusTime) >= float(self.settings.get('cooldown', 0)) and self.interactable:
+            pass_start = self.clock.time()
+            self._blocked = 0.0
+            # Clear before draining so a press pushed during the drain re-arms the wakeup
+            self.event_wakeup.clear()
+            self.process_events()
+            now = self.clock.time()
+            self.timeRemaining = (duration - (now - self.startTime)).__round__(2)
+            if (now - self.lastStimulusTime) >= cooldown and self.interactable:
                 print("No interaction in last 10s, Re-Stimming")
                 self.give_stimulus()
+                self._blocked += self.lastStimulusTime - now # The light flash blocks; not counted against the loop's time budget
 
             #Finish trial
             if self.currentIteration >= goal or self.timeRemaining <= 0:
-                self.total_time = (time.time() - self.startTime).__round__(2)
+                self.total_time = (self.clock.time() - self.startTime).__round__(2)
                 if self.interactable: #This is here to make sure it records the last interaction
                     #TODO Find a better way to do this ^^
                     self.finish_trial()
                     break
-            time.sleep(.10)
+            if self.checkpoint is not None and now >= self._next_checkpoint:
+                self.save_checkpoint()
+                self._next_checkpoint = now + CHECKPOINT_INTERVAL
+            self.watchdog.loop_pass("trial loop", pass_start + self._blocked, {"iteration": self.currentIteration})
+            # Sleep until the next tick, waking early if a press is queued
+            tick_due = self.clock.time() + .10
+            if not self.clock.wait(self.event_wakeup, .10):
+                self.watchdog.observe("trial tick", tick_due)
+
+        self.watchdog.unwatch()
+        with self.lock:
+            self._looping = False
+            if self.checkpoint is not None:
+                if self.state in ('Completed', 'Idle'):
+                    self.checkpoint.finish() # Finished or stopped on purpose: nothing to recover
+                else:
+                    self.save_checkpoint() # Paused: keep it, stop_trial() finishes it
             
     ## Interactions ##
-    def lever_press(self):
-        current_time = time.time()
+    # The GPIO callbacks only stamp and queue the press. All trial state is
+    # updated on the trial thread in process_events(), so nothing here races
+    # with run_trial and the callback returns immediately.
+    # ConditionedButton passes the accepted press time (time.monotonic); the
+    # simulated box calls them without one, which stamps the press now.
+    def lever_press(self, pressed_at=None):
+        self.events.push_at(LEVER_PRESS, pressed_at)
+
+    def nose_poke(self, pressed_at=None):
+        self.events.push_at(NOSE_POKE, pressed_at)
+
+    def inject(self, code):
+        with self.manual_lock:
+            self.manual_events.push(code)
+
+    def process_events(self):
+        batch = self._event_batch
+        batch.clear()
+        # Manual ring first: at equal stamps a stimulus onset applies before the press it enabled
+        for stamp, code in drain_rings((self.manual_events, self.events), batch):
+            if code == LEVER_PRESS:
+                self.handle_interaction("Lever Press", stamp)
+            elif code == NOSE_POKE:
+                self.handle_interaction("Nose poke", stamp)
+            elif code == STIMULUS_ONSET:
+                self.interactable = True
+                self.lastStimulusTime = stamp
+
+    def handle_interaction(self, interaction_type, current_time):
         self.total_interactions += 1
 
         if self.state == 'Running' and self.interactable:
@@ -539,75 +891,128 @@ class TrialStateMachine:
             self.interactable = False  # Disallow further interactions until reset
             self.currentIteration += 1
             self.give_reward()
-            self.add_interaction("Lever Press", "Yes", self.interactions_between, self.time_between)
+            self.add_interaction(interaction_type, "Yes", self.interactions_between, self.time_between, current_time)
             self.lastSuccessfulInteractTime = current_time  # Update only on successful interaction when interactable
             self.interactions_between = 0
         else:
-            self.add_interaction("Lever Press", "No", self.interactions_between, 0)
+            self.add_interaction(interaction_type, "No", self.interactions_between, 0, current_time)
             self.interactions_between += 1
+        self.save_checkpoint()
+
+    ## Checkpoints ##
+    # Times are saved relative to the start of the trial so they stay valid
+    # when the trial is resumed by a new process with a different clock.
+    def checkpoint_state(self):
+        start = self.startTime if self.startTime is not None else self.clock.time()
+        return {
+            'elapsed': round(self.clock.time() - start, 1),
+            'currentIteration': self.currentIteration,
+            'timeRemaining': round(self.timeRemaining, 1),
+            'total_interactions': self.total_interactions,
+            'interactions_between': self.interactions_between,
+            'interactable': self.interactable,
+            'lastSuccessfulInteract': None if self.lastSuccessfulInteractTime is None else round(self.lastSuccessfulInteractTime - start, 3),
+            'lastStimulus': round(self.lastStimulusTime - start, 3),
+        }
 
-    def nose_poke(self):
-        current_time = time.time()
-        self.total_interactions += 1
-
-        if self.state == 'Running' and self.interactable:
-            if self.lastSuccessfulInteractTime is not None:
-                self.time_between = (current_time - self.lastSuccessfulInteractTime).__round__(2)
-            else:
-                self.time_between = 0  # Default for the first successful interaction
-
-            self.interactable = False
-            self.currentIteration += 1
-            self.give_reward()
-            self.add_interaction("Nose poke", "Yes", self.interactions_between, self.time_between)
-            self.lastSuccessfulInteractTime = current_time  # Update only on successful interaction when interactable
-            self.interactions_between = 0
+    def save_checkpoint(self):
+        if self.checkpoint is not None:
+            try:
+                self.checkpoint.update(self.checkpoint_state(), self.interactions)
+            except OSError as e:
+                print(f"Error writing checkpoint: {e}")
+
+    def _restore(self, session):
+        self.settings = dict(session['settings'])
+        state = session['state']
+        self.log_path = session.get('log_path') or self.log_path
+        self.interactions = [list(row) for row in session['interactions']]
+        self.currentIteration = state.get('currentIteration', 0)
+        self.total_interactions = state.get('total_interactions', len(self.interactions))
+        self.interactions_between = state.get('interactions_between', 0)
+        self.interactable = state.get('interactable', True)
+        elapsed = state.get('elapsed', 0.0)
+        self.startTime = self.clock.time() - elapsed # Time the backend was down is not counted
+        if state.get('lastSuccessfulInteract') is not None:
+            self.lastSuccessfulInteractTime = self.startTime + state['lastSuccessfulInteract']
+        self.lastStimulusTime = self.startTime + state.get('lastStimulus', elapsed)
+        return elapsed
+
+    def resume_from_checkpoint(self, session, background=True):
+        with self.lock:
+            if self.state != 'Idle':
+                return False
+            plan = compile_protocol(session['settings']) # Checked before any state is restored
+            elapsed = self._restore(session)
+            self.use_plan(plan)
+            goal = plan.goal
+            duration = plan.duration_s
+            self.timeRemaining = duration - elapsed
+            if plan.tone is not None:
+                self.io.prepare_tone(plan.tone)
+            self.state = 'Running'
+        if not self.interactable:
+            self.queue_stimulus() # The pending cooldown timer died with the old process
+        if background:
+            threading.Thread(target=self.run_trial, args=(goal, duration, True), name="trial").start()
         else:
-            self.add_interaction("Nose poke", "No", self.interactions_between, 0)
-            self.interactions_between += 1
+            self.run_trial(goal, duration, True)
+        return True
+
+    def finalize_from_checkpoint(self, session):
+        with self.lock:
+            elapsed = self._restore(session)
+            self.total_time = round(elapsed, 2)
+            self.state = 'Completed'
+            self.push_log()
+        return True
 
     ## Stimulus' ##
     def queue_stimulus(self): # Give after cooldown
-        if(self.settings.get('stimulusType') == 'light' and self.interactable == False):
-            self.stimulusCooldownThread = threading.Timer(float(self.settings.get('cooldown', 0)), self.light_stimulus)
-            self.stimulusCooldownThread.start()
-        elif(self.settings.get('stimulusType') == 'tone' and self.interactable == False):
-            self.stimulusCooldownThread = threading.Timer(float(self.settings.get('cooldown', 0)), self.noise_stimulus)
-            self.stimulusCooldownThread.start()
+        if not self.interactable:
+            self.stimulusCooldownThread = self.timed_stimulus(self._stimulus)
+
+    def timed_stimulus(self, stimulus):
+        # Runs the stimulus after the cooldown and reports how late the timer fired
+        cooldown = self.plan.cooldown_s
+        due = self.clock.time() + cooldown
+        def fire():
+            self.watchdog.tune()
+            self.watchdog.observe("stimulus timer", due, {"cooldown": cooldown})
+            stimulus()
+        return self.clock.timer(cooldown, fire, name="stimulus")
 
     def give_stimulus(self): #Give immediately
-        if(self.settings.get('stimulusType') == 'light'):
-            self.light_stimulus()
-        elif(self.settings.get('stimulusType') == 'tone'):
-            self.noise_stimulus()
-        self.lastStimulusTime = time.time()  # Reset the timer after delivering the stimulus
+        self._stimulus()
+        self.lastStimulusTime = self.clock.time()  # Reset the timer after delivering the stimulus
 
     def light_stimulus(self):
-        if(strip):
-            hex_color = self.settings.get('light-color') # Html uses hexadecimal colors
-            r, g, b = int(hex_color[1:3], 16), int(hex_color[3:5], 16), int(hex_color[5:], 16) #So we convert it to rgb
-            color = Color(r,g,b)
-            flashLightStim(strip, color)
-            self.interactable = True
-            self.lastStimulusTime = time.time()
+        # The color was parsed and packed for the strip when the plan was bound.
+        # May run on the cooldown timer thread, so the onset goes through the ring.
+        if self.io.flash(self._light_color):
+            self.inject(STIMULUS_ONSET)
 
     def noise_stimulus(self):
-        if(self.interactable == False):
-            #TODO Make noise
-            self.interactable = True
+        # Queued to the audio thread; the box becomes interactable at tone onset
+        self.io.tone(self.plan.tone, self.tone_onset)
+
+    def tone_onset(self):
+        # Called on the audio thread; the trial thread applies it in process_events()
+        self.inject(STIMULUS_ONSET)
 
     ## Reward ##
     def give_reward(self):
-        if(self.settings.get('rewardType') == 'water'):
-            water()
-        elif(self.settings.get('rewardType') == 'food'):
-            feed()
+        started = self.clock.time()
+        self._reward(self.clock.sleep)
+        self._blocked += self.clock.time() - started # Not counted against the loop's time budget
         self.queue_stimulus()
 
     ## Logging ##
-    def add_interaction(self, interaction_type, reward_given, interactions_between=0, time_between=''):
+    def add_interaction(self, interaction_type, reward_given, interactions_between=0, time_between='', timestamp=None):
         entry = self.total_interactions
-        interaction_time = (time.time() - self.startTime).__round__(2)
+        if timestamp is None:
+            timestamp = self.clock.time()
+        interaction_time = (timestamp - self.startTime).__round__(2)
         
         # Log the interaction
         self.interactions.append([entry, interaction_time, interaction_type, reward_given, interactions_between, time_between])
@@ -652,15 +1057,26 @@ class TrialStateMachine:
         # TODO Code to handle errors
         pass
 
-# Run the app
-if __name__ == '__main__':
+def start_backend():
+    # Startup wiring, run before the app serves: by __main__ below, and by
+    # serve.py when this module is served with SB_APP=skinnerBox
+    global trial_state_machine
     # Create a state machine
-    trial_state_machine = TrialStateMachine() # Create an instance of the TrialStateMachine class
-    water_primer.when_pressed = start_motor # Start the motor when the water primer is pressed
-    start_trial_button.when_pressed = trial_state_machine.start_trial # Start the trial when the start button is pressed
-    manual_interaction.when_pressed = water # Water when the manual interaction button is pressed
+    trial_state_machine = TrialStateMachine(checkpoint_path=trial_checkpoint_path) # Create an instance of the TrialStateMachine class
+    recover_interrupted_trial(trial_state_machine) # Pick up a session that was running when the backend went down
+    outbox.get() # Resume delivering rows queued before a restart
+    # The water primer, start and manual buttons are commented out in the I/O
+    # region above, so nothing is bound to them here
 
     # Call the function to ensure naming is correct
     rename_log_files() # Rename log files with spaces and colons to underscores. Probably not needed in production, mostly used in testing.
+    threading.Thread(target=warm_up_hardware, name="warm-up", daemon=True).start()
+    threading.Thread(target=archive_old_logs, name="log-archive", daemon=True).start()
+
+# Run the app
+if __name__ == '__main__':
+    start_backend()
+    startup.mark("ready to serve")
+    startup.report()
     # Start the Flask app
     app.run(debug=False, use_reloader=False, host='0.0.0.0')
\ No newline at end of file
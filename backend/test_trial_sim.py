@@ -0,0 +1,60 @@
+"""
+Whole-session regression tests on the simulated clock (see trial_sim.py).
+
+    python -m pytest test_trial_sim.py
+"""
+import csv
+
+from trial_sim import respond_after, run_simulated_session
+
+SETTINGS = {
+    "interactionType": "lever",
+    "stimulusType": "light",
+    "rewardType": "food",
+    "cooldown": "5",
+    "goal": "3",
+    "duration": "60",
+    "light-color": "#ff0000",
+}
+RED = (255 << 16)
+
+
+def test_responder_session(tmp_path):
+    result = run_simulated_session(SETTINGS, responder=respond_after(1.5), log_dir=str(tmp_path))
+
+    assert result["state"] == "Completed"
+    assert result["iterations"] == 3
+    assert result["total_interactions"] == 3
+    # Press 1.5 s after each light; the feeder runs 1 s, then the 5 s cooldown
+    # before the next light. The trial ends at the first light after the goal.
+    assert result["outputs"] == [
+        (0.0, "light", RED), (1.5, "feed", None),
+        (7.5, "light", RED), (9.0, "feed", None),
+        (15.0, "light", RED), (16.5, "feed", None),
+        (22.5, "light", RED),
+    ]
+    assert result["total_time"] == 22.5
+    assert result["interactions"] == [
+        [1, 1.5, "Lever Press", "Yes", 0, 0],
+        [2, 9.0, "Lever Press", "Yes", 0, 7.5],
+        [3, 16.5, "Lever Press", "Yes", 0, 7.5],
+    ]
+
+    with open(result["log_path"], newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0][4:] == ["Entry", "Interaction Time", "Type", "Reward", "Interactions Between", "Time Between"]
+    assert rows[1][1:3] == ["22.5", "3"]
+    assert [row[4:] for row in rows[1:]] == [
+        ["1", "1.5", "Lever Press", "Yes", "0", "0"],
+        ["2", "9.0", "Lever Press", "Yes", "0", "7.5"],
+        ["3", "16.5", "Lever Press", "Yes", "0", "7.5"],
+    ]
+
+
+def test_same_inputs_same_session(tmp_path):
+    presses = [(0.5, "lever"), (3.0, "lever"), (4.0, "poke")]
+    first = run_simulated_session(SETTINGS, presses, respond_after(2.0), log_dir=str(tmp_path))
+    second = run_simulated_session(SETTINGS, presses, respond_after(2.0), log_dir=str(tmp_path))
+
+    assert first["interactions"] == second["interactions"]
+    assert first["outputs"] == second["outputs"]
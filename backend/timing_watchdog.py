@@ -0,0 +1,169 @@
+"""
+Timing watchdog for the trial thread and the stimulus timers.
+
+Each timed thread reports when it woke up against when it was due
+(`observe`), and the trial loop reports how long each pass took
+(`loop_pass`). Anything later than `lag_threshold`, or a pass longer than
+`pass_budget`, is kept as an overrun together with what was going on.
+
+A monitor thread also watches the trial loop's heartbeat. If the loop hasn't
+come round for `stall_after` seconds, the trial thread's current stack is
+recorded, so a stall shows where it was stuck and not just that it happened.
+
+Optional OS tuning for the timed threads (Linux only), from TRIAL_RT:
+    off   (default) leave scheduling alone
+    nice  raise the thread's priority (nice -10; needs CAP_SYS_NICE)
+    fifo  SCHED_FIFO real-time priority (needs CAP_SYS_NICE or root)
+and TRIAL_CPUS, e.g. "3" or "2,3", to pin those threads to CPUs.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+from latency_stats import percentile
+
+RT_MODE = os.getenv("TRIAL_RT", "off")
+RT_CPUS = os.getenv("TRIAL_CPUS", "")
+FIFO_PRIORITY = 20
+NICE_LEVEL = -10
+
+
+def tune_current_thread(mode=RT_MODE, cpus=RT_CPUS):
+    """
+    Applies the TRIAL_RT / TRIAL_CPUS settings to the calling thread.
+    Returns a short description of what was applied, or of why it wasn't.
+    """
+    applied = []
+    if mode == "off" and not cpus:
+        return "default"
+    if not sys.platform.startswith("linux"):
+        return "unsupported platform"
+    try:
+        if mode == "fifo":
+            # On Linux, pid 0 means the calling thread
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(FIFO_PRIORITY))
+            applied.append(f"SCHED_FIFO {FIFO_PRIORITY}")
+        elif mode == "nice":
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICE_LEVEL)
+            applied.append(f"nice {NICE_LEVEL}")
+        if cpus:
+            os.sched_setaffinity(0, {int(cpu) for cpu in cpus.split(",")})
+            applied.append(f"cpus {cpus}")
+    except (OSError, ValueError) as e:
+        applied.append(f"failed: {e}")
+    return ", ".join(applied) or "default"
+
+
+class TimingWatchdog:
+    def __init__(self, clock, lag_threshold=0.02, pass_budget=0.05, stall_after=2.0, history=100, recent=512):
+        self.clock = clock
+        self.lag_threshold = lag_threshold
+        self.pass_budget = pass_budget
+        self.stall_after = stall_after
+        self.overruns = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._recent = recent
+        self.tuning = {}  # thread name -> what tune_current_thread applied
+
+        self._heartbeat = None
+        self._watched_thread = None
+        self._monitor = None
+        self.stalls = 0
+
+    def _record(self, name, value, limit, context):
+        with self._lock:
+            entry = self._stats.get(name)
+            if entry is None:
+                entry = self._stats[name] = {"count": 0, "max": 0.0, "total": 0.0, "overruns": 0,
+                                             "recent": collections.deque(maxlen=self._recent)}
+            entry["count"] += 1
+            entry["total"] += value
+            entry["max"] = max(entry["max"], value)
+            entry["recent"].append(value)
+            if value > limit:
+                entry["overruns"] += 1
+                self.overruns.append({
+                    "at": round(time.time(), 3),
+                    "what": name,
+                    "ms": round(value * 1000, 3),
+                    "limit_ms": round(limit * 1000, 3),
+                    "thread": threading.current_thread().name,
+                    "context": context,
+                })
+
+    def observe(self, name, due, context=None):
+        """Called by a thread right after it wakes for something due at `due` (clock time)."""
+        self._record(name + " lag", max(0.0, self.clock.time() - due), self.lag_threshold, context)
+
+    def loop_pass(self, name, started, context=None):
+        """Called at the end of one pass of a loop that began at `started` (clock time)."""
+        self._heartbeat = time.monotonic()
+        self._record(name + " pass", self.clock.time() - started, self.pass_budget, context)
+
+    def tune(self):
+        """Applies TRIAL_RT / TRIAL_CPUS to the calling thread."""
+        self.tuning[threading.current_thread().name] = tune_current_thread()
+
+    ## Stall monitor (real time only) ##
+    def watch(self, thread=None):
+        """Starts watching the heartbeat of `thread` (default: the calling thread)."""
+        self._heartbeat = time.monotonic()
+        self._watched_thread = thread or threading.current_thread()
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._watch, name="timing-watchdog", daemon=True)
+            self._monitor.start()
+
+    def unwatch(self):
+        # The monitor thread stays (it is idle while nothing is watched)
+        self._watched_thread = None
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.stall_after / 2)
+            beat = self._heartbeat
+            thread = self._watched_thread
+            if beat is None or thread is None:
+                continue
+            stalled = time.monotonic() - beat
+            if stalled < self.stall_after or reported == beat:
+                continue
+            reported = beat  # One report per stall
+            frame = sys._current_frames().get(thread.ident)
+            stack = traceback.format_stack(frame, limit=8) if frame is not None else []
+            self.stalls += 1
+            with self._lock:
+                self.overruns.append({
+                    "at": round(time.time(), 3),
+                    "what": "stall",
+                    "ms": round(stalled * 1000, 3),
+                    "limit_ms": round(self.stall_after * 1000, 3),
+                    "thread": thread.name,
+                    "context": {"stack": [line.strip() for line in stack]},
+                })
+
+    def stats(self):
+        with self._lock:
+            items = [(name, dict(entry, recent=sorted(entry["recent"]))) for name, entry in self._stats.items()]
+            overruns = list(self.overruns)
+        summary = {}
+        for name, entry in items:
+            recent = entry["recent"]
+            summary[name] = {
+                "count": entry["count"],
+                "overruns": entry["overruns"],
+                "mean_ms": round(entry["total"] / entry["count"] * 1000, 3),
+                "p99_ms": round(percentile(recent, 99) * 1000, 3),
+                "max_ms": round(entry["max"] * 1000, 3),
+            }
+        return {
+            "thresholds_ms": {"lag": self.lag_threshold * 1000, "pass": self.pass_budget * 1000, "stall": self.stall_after * 1000},
+            "timings": summary,
+            "stalls": self.stalls,
+            "tuning": dict(self.tuning),
+            "recent_overruns": overruns,
+        }
@@ -0,0 +1,128 @@
+"""
+Crash-safe checkpoints of a running trial.
+
+While a trial runs, its state is appended to a small JSON-lines file:
+
+    {"t": "start", "wall": ..., "settings": {...}, "log_path": ..., "state": {...}}
+    {"t": "d", "wall": ..., "state": {<only fields that changed>}, "i": [<new interaction rows>]}
+    ...
+    {"t": "end", "wall": ...}
+
+Records are flushed to the OS on every write and fsync'd in batches (every
+`fsync_every` records or `fsync_interval` seconds), so a checkpoint costs a
+few microseconds on the trial thread. Replaying the file gives the last
+saved state; a file without an "end" record is an interrupted session.
+
+A new file is written next to the old one and swapped in with os.replace,
+so the previous checkpoint (the only copy of a session being resumed) is
+never truncated before the new start record is on disk.
+"""
+import json
+import os
+import time
+
+
+class CheckpointWriter:
+    def __init__(self, path, fsync_every=20, fsync_interval=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._last_state = {}
+        self._interactions_written = 0
+        self._unsynced = 0
+        self._last_sync = 0.0
+
+    def _write(self, record, force_sync=False):
+        record["wall"] = round(time.time(), 3)
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        now = time.monotonic()
+        if force_sync or self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = now
+
+    def start(self, settings, log_path, state, interactions=()):
+        """Starts a new checkpoint file (replacing any old one once the start record is synced)."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        self._file = open(tmp, "w")
+        self._last_state = dict(state)
+        self._interactions_written = len(interactions)
+        self._write({"t": "start", "settings": settings, "log_path": log_path, "state": state, "i": list(interactions)}, force_sync=True)
+        os.replace(tmp, self.path)  # The open file now is the checkpoint; later records append to it
+
+    def update(self, state, interactions):
+        """Appends only what changed since the last record. Does nothing if nothing changed."""
+        if self._file is None:
+            return
+        changed = {k: v for k, v in state.items() if self._last_state.get(k) != v}
+        new_rows = interactions[self._interactions_written:]
+        if not changed and not new_rows:
+            return
+        record = {"t": "d", "state": changed}
+        if new_rows:
+            record["i"] = list(new_rows)
+            self._interactions_written += len(new_rows)
+        self._last_state.update(changed)
+        self._write(record)
+
+    def finish(self):
+        """Marks the session complete and removes the checkpoint."""
+        if self._file is None:
+            return
+        self._write({"t": "end"}, force_sync=True)
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def load_checkpoint(path):
+    """
+    Replays a checkpoint file. Returns None if there is no file or the
+    session ended cleanly, otherwise a dict with settings, log_path, state,
+    interactions and `wall` (when the last record was written).
+    A partially written last line (crash mid-write) is ignored.
+    """
+    try:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None
+
+    session = None
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        kind = record.get("t")
+        if kind == "start":
+            session = {
+                "settings": record.get("settings", {}),
+                "log_path": record.get("log_path"),
+                "state": dict(record.get("state", {})),
+                "interactions": list(record.get("i", [])),
+                "wall": record.get("wall"),
+            }
+        elif session is not None and kind == "d":
+            session["state"].update(record.get("state", {}))
+            session["interactions"].extend(record.get("i", []))
+            session["wall"] = record.get("wall")
+        elif kind == "end":
+            return None
+    return session
+
+
+def discard_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
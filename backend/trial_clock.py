@@ -0,0 +1,85 @@
+import heapq
+import threading
+import time
+
+
+class SystemClock:
+    """Real wall-clock time. This is what TrialStateMachine uses on the box."""
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        """Waits for a threading.Event, like event.wait(timeout)."""
+        return event.wait(timeout)
+
+    def timer(self, delay, function, name=None):
+        """Runs function after delay seconds. Returns an object with cancel()."""
+        t = threading.Timer(delay, function)
+        t.daemon = True
+        if name:
+            t.name = name
+        t.start()
+        return t
+
+
+class _ScheduledCall:
+    def __init__(self, function):
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SimulatedClock:
+    """
+    A virtual clock for running trials faster than real time.
+
+    Time only moves when the code under test sleeps or waits. Timers and
+    scripted calls (call_at) are kept in a queue and run, in order, on the
+    thread that advances the clock, so a whole session runs on one thread
+    and gives the same result every time.
+    """
+    def __init__(self, start=0.0):
+        self.now = float(start)
+        self._queue = []  # (due, seq, _ScheduledCall)
+        self._seq = 0
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, function):
+        call = _ScheduledCall(function)
+        heapq.heappush(self._queue, (float(when), self._seq, call))
+        self._seq += 1
+        return call
+
+    def timer(self, delay, function, name=None):
+        return self.call_at(self.now + delay, function)
+
+    def advance_to(self, when):
+        """Moves time forward to `when`, running everything scheduled up to then."""
+        while self._queue and self._queue[0][0] <= when:
+            due, _, call = heapq.heappop(self._queue)
+            self.now = max(self.now, due)
+            if not call.cancelled:
+                call.function()
+        self.now = max(self.now, when)
+
+    def sleep(self, seconds):
+        self.advance_to(self.now + seconds)
+
+    def wait(self, event, timeout):
+        # Like Event.wait, return as soon as something scheduled sets the event
+        deadline = self.now + timeout
+        while not event.is_set() and self._queue and self._queue[0][0] <= deadline:
+            self.advance_to(self._queue[0][0])
+        if not event.is_set():
+            self.advance_to(deadline)
+        return event.is_set()
+
+    def pending(self):
+        return sum(1 for _, _, call in self._queue if not call.cancelled)
@@ -0,0 +1,121 @@
+"""
+Trial protocols compiled from config.json settings.
+
+The settings arrive as form strings ("lever", "50", "#ff0000"). Instead of
+interpreting them on every event, compile_protocol() checks and converts
+them once, before a trial starts, into a TrialPlan: choices resolved to
+fixed values, numbers parsed, the light color split into RGB and the tone
+parameters ready to synthesize. TrialStateMachine binds its handlers from
+the plan, so a lever press or a cooldown timer makes direct calls only.
+
+Settings that can't be run raise ProtocolError listing every problem found,
+so the trial is refused before the animal is in the box.
+
+    python trial_protocol.py config.json
+"""
+import argparse
+import json
+import re
+from dataclasses import dataclass
+
+INTERACTIONS = ("lever", "poke")
+STIMULI = ("light", "tone")
+REWARDS = ("water", "food")
+TONE_TYPES = ("tone", "noise", "click")
+HEX_COLOR = re.compile(r"^#([0-9a-fA-F]{2})([0-9a-fA-F]{2})([0-9a-fA-F]{2})$")
+
+
+class ProtocolError(ValueError):
+    """Settings that can't be run. `problems` has one message per bad setting."""
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("; ".join(self.problems))
+
+
+@dataclass(frozen=True)
+class TrialPlan:
+    interaction: str  # One of INTERACTIONS
+    stimulus: str  # One of STIMULI
+    reward: str  # One of REWARDS
+    goal: int  # Rewarded interactions that end the trial
+    duration_s: int
+    cooldown_s: float  # Delay from a reward to the next stimulus, and the re-stimulus interval
+    rgb: tuple = None  # (r, g, b) 0-255, light stimulus only
+    tone: tuple = None  # (type, frequency, duration, volume) as AudioEngine.play takes them, tone only
+
+
+def parse_color(value):
+    """'#rrggbb' -> (r, g, b). Raises ValueError."""
+    match = HEX_COLOR.match(value.strip()) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"expected a color like #ff0000, got {value!r}")
+    return tuple(int(part, 16) for part in match.groups())
+
+
+def _choice(settings, key, choices, problems):
+    value = str(settings.get(key, "")).strip().lower()
+    if value not in choices:
+        problems.append(f"{key} must be one of {', '.join(choices)} (got {settings.get(key)!r})")
+    return value
+
+
+def _number(settings, key, kind, problems, default=None, low=None, high=None):
+    raw = settings.get(key, default)
+    try:
+        value = kind(raw)
+    except (TypeError, ValueError):
+        problems.append(f"{key} must be {'a whole number' if kind is int else 'a number'} (got {raw!r})")
+        return None
+    if (low is not None and value < low) or (high is not None and value > high):
+        bounds = f"at least {low}" if high is None else f"between {low} and {high}"
+        problems.append(f"{key} must be {bounds} (got {raw!r})")
+        return None
+    return value
+
+
+def compile_protocol(settings):
+    """Checks `settings` (the config.json dict) and returns a TrialPlan, or raises ProtocolError."""
+    problems = []
+    interaction = _choice(settings, "interactionType", INTERACTIONS, problems)
+    stimulus = _choice(settings, "stimulusType", STIMULI, problems)
+    reward = _choice(settings, "rewardType", REWARDS, problems)
+    goal = _number(settings, "goal", int, problems, low=1)
+    duration = _number(settings, "duration", int, problems, low=1)  # Minutes
+    cooldown = _number(settings, "cooldown", float, problems, default=0, low=0)
+
+    rgb = None
+    tone = None
+    if stimulus == "light":
+        try:
+            rgb = parse_color(settings.get("light-color"))
+        except ValueError as e:
+            problems.append(f"light-color: {e}")
+    elif stimulus == "tone":
+        tone = (
+            _choice(settings, "tone-type", TONE_TYPES, problems) if "tone-type" in settings else "tone",
+            _number(settings, "tone-frequency", float, problems, default=2000, low=1),
+            _number(settings, "tone-duration", float, problems, default=1, low=0.001),
+            _number(settings, "tone-volume", float, problems, default=0.5, low=0, high=1),
+        )
+
+    if problems:
+        raise ProtocolError(problems)
+    return TrialPlan(interaction, stimulus, reward, goal, duration * 60, cooldown, rgb, tone)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check trial settings before running them")
+    parser.add_argument("settings", nargs="?", default="config.json")
+    args = parser.parse_args()
+    with open(args.settings) as f:
+        settings = json.load(f)
+    try:
+        print(compile_protocol(settings))
+    except ProtocolError as e:
+        for problem in e.problems:
+            print(f"- {problem}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Run whole trials on a simulated clock.
+
+A 60 minute protocol with scripted responses finishes in well under a
+second, and the same inputs always give the same log. Useful for
+regression-testing TrialStateMachine and for tuning protocol settings.
+
+    python trial_sim.py config.json --respond-after 2.5
+    python trial_sim.py config.json --press 1.0 --press 12.5 --poke 30
+"""
+import argparse
+import json
+import tempfile
+import time
+
+from skinnerBox import TrialStateMachine
+from trial_clock import SimulatedClock
+from trial_protocol import ProtocolError, compile_protocol
+
+
+class SimulatedIO:
+    """Stands in for HardwareIO: records every output instead of driving pins."""
+    FEED_S = 1.0  # How long the real feeder/water motors run, so simulated time matches
+    WATER_S = 0.15
+
+    def __init__(self, clock, responder=None):
+        self.clock = clock
+        self.responder = responder
+        self.inputs = {}
+        self.outputs = []  # (time, action, detail)
+
+    def _record(self, action, detail=None):
+        self.outputs.append((round(self.clock.time(), 3), action, detail))
+
+    def _stimulus_onset(self):
+        if self.responder is not None:
+            self.responder(self)
+
+    def feed(self, sleep=None):
+        self._record("feed")
+        if sleep is not None:
+            sleep(self.FEED_S)
+
+    def water(self, sleep=None):
+        self._record("water")
+        if sleep is not None:
+            sleep(self.WATER_S)
+
+    def flash(self, color):
+        self._record("light", color)
+        self._stimulus_onset()
+        return True
+
+    def prepare_tone(self, params):
+        self._record("prepare_tone", params)
+
+    def tone(self, params, on_onset):
+        self._record("tone", params)
+        on_onset()
+        self._stimulus_onset()
+
+    def bind_input(self, interaction_type, callback):
+        self.inputs[interaction_type] = callback
+
+    def press(self, interaction_type):
+        callback = self.inputs.get(interaction_type)
+        if callback is not None:
+            callback()
+
+
+def respond_after(delay, interaction_type="lever"):
+    """A simulated animal that responds `delay` seconds after every stimulus."""
+    def responder(io):
+        io.clock.timer(delay, lambda: io.press(interaction_type))
+    return responder
+
+
+def run_simulated_session(settings, presses=(), responder=None, log_dir=None, start=0.0):
+    """
+    Runs one trial to completion on a SimulatedClock.
+
+    presses: (seconds_from_start, 'lever' | 'poke') pairs, delivered as if from the GPIO
+    responder: called at every stimulus onset, e.g. respond_after(2.0)
+    Returns the final trial state, the logged interactions and every output given.
+    """
+    clock = SimulatedClock(start)
+    io = SimulatedIO(clock, responder)
+    machine = TrialStateMachine(clock=clock, io=io, log_dir=log_dir or tempfile.mkdtemp(prefix="trial_sim_"))
+    for at, interaction_type in presses:
+        clock.call_at(start + at, lambda kind=interaction_type: io.press(kind))
+
+    wall_start = time.perf_counter()
+    machine.start_trial(settings=settings, background=False)
+    return {
+        "state": machine.state,
+        "iterations": machine.currentIteration,
+        "total_interactions": machine.total_interactions,
+        "total_time": machine.total_time,
+        "interactions": machine.interactions,
+        "outputs": io.outputs,
+        "log_path": machine.log_path,
+        "wall_time_s": round(time.perf_counter() - wall_start, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("settings", help="Trial settings JSON (same format as config.json)")
+    parser.add_argument("--press", type=float, action="append", default=[], help="Lever press at this many seconds")
+    parser.add_argument("--poke", type=float, action="append", default=[], help="Nose poke at this many seconds")
+    parser.add_argument("--respond-after", type=float, help="Respond this many seconds after every stimulus")
+    args = parser.parse_args()
+
+    with open(args.settings) as f:
+        settings = json.load(f)
+    try:
+        plan = compile_protocol(settings)
+    except ProtocolError as e:
+        parser.error(f"invalid settings: {e}")
+    presses = [(t, "lever") for t in args.press] + [(t, "poke") for t in args.poke]
+    responder = None
+    if args.respond_after is not None:
+        responder = respond_after(args.respond_after, plan.interaction)
+
+    result = run_simulated_session(settings, presses, responder)
+    print(f"state={result['state']} iterations={result['iterations']} interactions={result['total_interactions']} "
+          f"simulated={result['total_time']}s wall={result['wall_time_s']}s")
+    print(f"log written to {result['log_path']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,18 @@ export const getCounts = async () => {
   }
 };
 
+// Downsampled per-second counts for charts,
+// e.g. getCountSeries({ window_s: 3600, points: 300, method: 'lttb', kind: 'cumulative' })
+export const getCountSeries = async (params = {}) => {
+  try {
+    const response = await axios.get(`${API_URL}/counts/series`, { params });
+    return response.data;
+  } catch (error) {
+    console.error("Error getting count series:", error);
+    throw error;
+  }
+};
+
 export const setBlueLight = async (action) => {
   try {
     const response = await axios.post(`${API_URL}/light/blue`, { action });
@@ -43,6 +55,30 @@ export const setRGBLight = async (red, green, blue) => {
   }
 };
 
+// Load test: injects a schedule of simulated presses in one request,
+// e.g. { type: 'both', rate: 500, duration_s: 10, wait: true }
+export const injectInputBatch = async (schedule) => {
+  try {
+    const response = await axios.post(`${API_URL}/api/input/batch`, schedule);
+    return response.data;
+  } catch (error) {
+    console.error("Error injecting inputs:", error);
+    throw error;
+  }
+};
+
+// Runs a list of timed output commands as one sequence on the backend,
+// e.g. [{ device: 'blue', value: 'on', at_ms: 0 }, { device: 'blue', value: 'off', at_ms: 500 }]
+export const runOutputTimeline = async (commands, replace = false) => {
+  try {
+    const response = await axios.post(`${API_URL}/outputs/timeline`, { commands, replace });
+    return response.data;
+  } catch (error) {
+    console.error("Error running output timeline:", error);
+    throw error;
+  }
+};
+
 // Test Management
 export const runTest = async (testSettings) => {
   try {